@@ -1,24 +1,62 @@
+import io
+import sqlite3
 import streamlit as st
 from datetime import datetime
-import pandas as pd
 from pathlib import Path
-import yaml
-from yaml.loader import SafeLoader
 import streamlit_authenticator as stauth
 
-from src.db import init_db, insert_tx, list_tx, add_rule, current_balance, get_all_rules, update_rule, delete_rule, update_tx, delete_tx
-from src.categorize import guess_category, normalize_store
-from src.receipt import parse_from_qr_image, parse_from_url
+from src.db import DATA_DIR, data_version, init_user_db, insert_tx, add_rule, current_balance, get_all_rules, update_rule, delete_rule, transaction, bulk_update_tx, bulk_delete_tx, \
+    tx_bounds, list_categories, count_tx, query_tx, totals_by_category, totals_by_month, income_expense
+from src.categorize import categorize_items, guess_category, normalize_store
+from src.receipt import parse_from_url, scan_receipts
+from src.batch import ingest
+from src.recategorize import recategorize
+from src import jobs, metrics
 
 st.set_page_config(page_title="SRB QR Receipt Tracker", layout="wide")
 
-DB_PATH = Path("data/receipts.db")
-init_db(DB_PATH)
+AUTH_PATH = Path(".streamlit/auth.yaml")
+PAGE_SIZE = 500
+
+
+@st.cache_resource
+def _user_db(username: str) -> Path:
+    """The signed-in user's own database (created and migrated once per process)."""
+    return init_user_db(DATA_DIR, username)
+
+
+@st.cache_data
+def _load_config(path: str, mtime: float) -> dict:
+    import yaml
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=yaml.SafeLoader)
+
+
+_READS = {f.__name__: f for f in (current_balance, tx_bounds, list_categories, count_tx, query_tx,
+                                   totals_by_category, totals_by_month, income_expense, get_all_rules)}
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _cached_read(name: str, db_path: str, version: int, *args, **kwargs):
+    return _READS[name](Path(db_path), *args, **kwargs)
+
+
+def read(fn, *args, **kwargs):
+    """`fn(DB_PATH, ...)` served from cache until the next commit to the database, from any process."""
+    return _cached_read(fn.__name__, str(DB_PATH), data_version(DB_PATH), *args, **kwargs)
+
+
+@st.cache_resource
+def _metrics_endpoint() -> int:
+    return metrics.serve()
+
+
+if metrics.ENABLED:
+    _metrics_endpoint()
 
 st.title("📄 Serbian QR Receipt Tracker")
 
-with open(".streamlit/auth.yaml", "r", encoding="utf-8") as f:
-    config = yaml.load(f, Loader=SafeLoader)
+config = _load_config(str(AUTH_PATH), AUTH_PATH.stat().st_mtime)
 
 authenticator = stauth.Authenticate(
     config['credentials'],
@@ -32,11 +70,16 @@ try:
 except Exception as e:
     st.error(e)
 if st.session_state.get('authentication_status'):
+    # pandas is only needed behind the login; the login page renders without it
+    import pandas as pd
+    # every user reads and writes only their own SQLite file, so one user's bulk import
+    # never holds the write lock another user is waiting for
+    DB_PATH = _user_db(st.session_state["username"])
     authenticator.logout()
     st.write(f'Welcome *{st.session_state.get("name")}*')
     tab_add, tab_history, tab_rules = st.tabs(["➕ Add", "📜 History", "⚙️ Rules"])
     with tab_add:
-        def save_record(ts, store, amount_rsds, category, raw_url=None, meta=None, kind="expense"):
+        def save_record(ts, store, amount_rsds, category, raw_url=None, meta=None, kind="expense", items=None):
             try:
                 iso = datetime.fromisoformat(ts).isoformat()
             except Exception:
@@ -44,7 +87,7 @@ if st.session_state.get('authentication_status'):
                     iso = pd.to_datetime(ts).to_pydatetime().isoformat()
                 except Exception:
                     iso = datetime.now().isoformat()
-            insert_tx(DB_PATH, {
+            tx_id = insert_tx(DB_PATH, {
                 "ts": iso,
                 "store": store,
                 "amount": float(amount_rsds),
@@ -53,41 +96,93 @@ if st.session_state.get('authentication_status'):
                 "source": "qr" if raw_url else "manual",
                 "raw_url": raw_url or None,
                 "meta_json": meta or {},
-                "kind": kind
+                "kind": kind,
+                "category_manual": category != guess_category(store, db=DB_PATH),
+                "items": categorize_items(items, DB_PATH),
             })
+            if tx_id is None:
+                st.warning("This receipt is already recorded.")
+                return
             st.success("✅ Saved")
 
+        def _job(key, fn, *args, **kwargs):
+            """Background future for `key`, started on first sight and kept across reruns."""
+            key = f"{DB_PATH}|{key}"   # per user: jobs write to the user's database
+            futs = st.session_state.setdefault("jobs", {})
+            if key not in futs:
+                futs[key] = jobs.submit(key, fn, *args, **kwargs)
+            return futs[key]
+
+        @st.fragment(run_every=0.5)
+        def _wait_for(fut, label):
+            """Polls a running job without blocking the page; reruns the app once it finishes."""
+            if fut.done():
+                st.rerun()
+            st.caption(f"⏳ {label}")
+
+        def _job_result(key, label, default):
+            """Result of job `key`, or `default` while it runs (polled) or after it failed (with a retry)."""
+            key = f"{DB_PATH}|{key}"
+            fut = st.session_state.get("jobs", {}).get(key)
+            if fut is None:
+                return default
+            if not fut.done():
+                _wait_for(fut, label)
+                return default
+            if fut.exception() is not None:
+                st.error(f"{label} failed: {fut.exception()}")
+                if st.button("Retry", key=f"retry:{key}"):
+                    jobs.forget(key)
+                    del st.session_state["jobs"][key]
+                    st.rerun()
+                return default
+            return fut.result()
+
+        def _scan(data):
+            return [u for _, u in scan_receipts(io.BytesIO(data))]
+
         url = ""
-        store = ""
-        amount = None
-        dt_str = ""
-        file = st.file_uploader("Upload receipt photo/scan (JPG/PNG)", type=["jpg","jpeg","png"])
+        p = {}
+        mode = "manual"
+        file = st.file_uploader("Upload receipt photo/scan (JPG/PNG/TIFF/PDF)",
+                                type=["jpg","jpeg","png","tif","tiff","pdf"])
         if file:
-            with st.spinner("Scanning QR..."):
-                parsed_qr = parse_from_qr_image(file)
-            if parsed_qr and parsed_qr.get("url"):
-                url = parsed_qr["url"]
+            scan_key = f"scan:{file.file_id}"
+            _job(scan_key, _scan, file.getvalue())
+            found = _job_result(scan_key, "Scanning QR...", None)
+            if found and len(found) > 1:
+                st.write(f"Found {len(found)} receipts:")
+                st.code("\n".join(found), language="text")
+                ingest_key = f"ingest:{file.file_id}"
+                if st.button(f"💾 Save all {len(found)} receipts"):
+                    _job(ingest_key, ingest, DB_PATH, found, use_processes=False)
+                report = _job_result(ingest_key, "Fetching receipts...", None)
+                if report is not None:
+                    saved = sum(1 for r in report if r["status"] == "ok")
+                    st.success(f"Saved {saved} of {len(report)} receipts")
+                    for r in report:
+                        if r["status"] == "duplicate":
+                            st.info(f"{r['url']}: {r['error']}")
+                        elif r["status"] != "ok":
+                            st.error(f"{r['url']}: {r['error']}")
+            elif found:
+                url = found[0]
                 st.code(url, language="text")
-                with st.spinner("Parsing URL data..."):
-                    p = parse_from_url(url)
-                    mode = "qr_image"
-            else:
+                _job(f"url:{url}", parse_from_url, url, db_path=DB_PATH, strict=True)
+                p = _job_result(f"url:{url}", "Parsing URL data...", {})
+                mode = "qr_image"
+            elif found is not None:
                 st.error("QR not found in image.")
-                p = {}
-        else:
-            p = {}
-            url = ""
-        url = st.text_input("QR URL", placeholder="Paste receipt URL")
-        if url:
-            p = parse_from_url(url)
+        url_input = st.text_input("QR URL", placeholder="Paste receipt URL").strip()
+        if url_input:
+            url = url_input
+            _job(f"url:{url}", parse_from_url, url, db_path=DB_PATH, strict=True)
+            p = _job_result(f"url:{url}", "Parsing URL data...", {})
             mode = "url_input"
-        elif p == {}:
-            p = {}
-            mode = "manual"
         store = normalize_store(p.get("store") or "")
         amount = float(p.get("amount") or 0) if p.get("amount") else None
         dt_str = p.get("ts") or ""
-        balance = current_balance(DB_PATH)
+        balance = read(current_balance)
         st.metric("Current balance", f"{balance:,.2f} RSD".replace(",", " "))
         col1, col2, col3, col4 = st.columns([2,1,2,1])
         with col1:
@@ -101,6 +196,9 @@ if st.session_state.get('authentication_status'):
         col_type, _ = st.columns([1,3])
         with col_type:
             tx_kind = st.radio("Type", ["expense", "income"], index=0, horizontal=True)
+        if p.get("items"):
+            with st.expander(f"Items ({len(p['items'])})"):
+                st.dataframe(pd.DataFrame(p["items"]), hide_index=True, use_container_width=True)
 
         col_save = st.columns([1])
         with col_save[0]:
@@ -108,29 +206,67 @@ if st.session_state.get('authentication_status'):
                 if not store or not amount:
                     st.error("Store and Amount required.")
                 else:
-                    save_record(dt_str, store, amount, category, raw_url=url, meta={"source": mode}, kind=tx_kind)
+                    save_record(dt_str, store, amount, category, raw_url=url, meta={"source": mode}, kind=tx_kind,
+                                items=p.get("items"))
     with tab_history:
+        def _changed_cells(before, after, cols):
+            """{id: {column: value}} for the cells the user actually edited."""
+            b = before.set_index("id")[cols]
+            a = after.set_index("id")[cols].reindex(b.index)
+            diff = (a != b) & ~(a.isna() & b.isna())
+            stacked = diff.stack()
+            out = {}
+            for tx_id, col in stacked[stacked].index:
+                v = a.at[tx_id, col]
+                if col == "amount":
+                    try:
+                        v = float(v)
+                    except Exception:
+                        continue
+                elif col == "ts":
+                    try:
+                        v = pd.to_datetime(v).to_pydatetime().isoformat()
+                    except Exception:
+                        v = str(v)
+                else:
+                    v = str(v or "").strip()
+                    if col == "currency":
+                        v = v or "RSD"
+                fields = out.setdefault(int(tx_id), {})
+                fields[col] = v
+                if col == "category":
+                    fields["category_manual"] = 1
+            return out
+
         st.header("📜 History")
 
-        df = pd.DataFrame(list_tx(DB_PATH, limit=2000))
-        if not df.empty:
-            balance = current_balance(DB_PATH)
+        first_ts, last_ts = read(tx_bounds)
+        if first_ts:
+            balance = read(current_balance)
             st.metric("Current balance", f"{balance:,.2f} RSD".replace(",", " "))
 
-            df["date"] = pd.to_datetime(df["ts"]).dt.date
+            all_categories = read(list_categories)
             c1, c2, c3 = st.columns(3)
             with c1:
-                date_from = st.date_input("From date", value=df["date"].min())
+                date_from = st.date_input("From date", value=pd.to_datetime(first_ts).date())
             with c2:
-                date_to = st.date_input("To date", value=df["date"].max())
+                date_to = st.date_input("To date", value=pd.to_datetime(last_ts).date())
             with c3:
-                cat_filter = st.multiselect("Categories", options=sorted(df["category"].unique()),
-                                            default=list(sorted(df["category"].unique())))
+                cat_filter = st.multiselect("Categories", options=all_categories, default=all_categories)
+            # untouched bounds stay open so whole-month totals come from the rollup tables
+            flt = dict(
+                date_from=None if date_from <= pd.to_datetime(first_ts).date() else date_from,
+                date_to=None if date_to >= pd.to_datetime(last_ts).date() else date_to,
+                categories=cat_filter,
+            )
 
-            df["date"] = pd.to_datetime(df["date"]).dt.date
-            mask = (df["date"] >= date_from) & (df["date"] <= date_to) & (df["category"].isin(cat_filter))
-            fdf = df.loc[mask].copy()
-            fdf = fdf[["id","ts","store","amount","currency","category","kind"]]
+            total_rows = read(count_tx, **flt)
+            pages = max(1, -(-total_rows // PAGE_SIZE))
+            page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1)
+            st.caption(f"{total_rows} records, {pages} page(s)")
+            cols = ["id","ts","store","amount","currency","category","kind"]
+            fdf = pd.DataFrame(read(query_tx, **flt, limit=PAGE_SIZE, offset=(int(page) - 1) * PAGE_SIZE),
+                               columns=cols)
             fdf["__delete"] = False
             edited = st.data_editor(
                 fdf,
@@ -152,53 +288,36 @@ if st.session_state.get('authentication_status'):
             csave, cdel = st.columns([1,1])
             with csave:
                 if st.button("💾 Save changes"):
-                    for _, row in edited.iterrows():
-                        tx_id = int(row["id"])
-                        try:
-                            amount = float(row["amount"])
-                        except Exception:
-                            continue
-                        try:
-                            ts_iso = pd.to_datetime(row["ts"]).to_pydatetime().isoformat()
-                        except Exception:
-                            ts_iso = str(row["ts"])
-
-                        update_tx(
-                            DB_PATH, tx_id,
-                            ts=ts_iso,
-                            store=str(row["store"]).strip(),
-                            amount=amount,
-                            currency=str(row.get("currency") or "RSD").strip(),
-                            category=str(row["category"]).strip(),
-                            kind=str(row["kind"]).strip(),
-                        )
-                    st.success("Changes saved")
+                    changes = _changed_cells(fdf, edited, ["ts","store","amount","currency","category","kind"])
+                    try:
+                        n = bulk_update_tx(DB_PATH, changes)
+                    except sqlite3.IntegrityError:
+                        st.error("Not saved: an edited row would duplicate a receipt that is already recorded.")
+                    else:
+                        st.success(f"Changes saved: {n}")
 
             with cdel:
                 if st.button("🗑 Delete selected"):
                     ids_to_delete = [int(row["id"]) for _, row in edited.iterrows() if bool(row["__delete"])]
-                    for tx_id in ids_to_delete:
-                        delete_tx(DB_PATH, tx_id)
+                    bulk_delete_tx(DB_PATH, ids_to_delete)
                     st.success(f"Deleted records: {len(ids_to_delete)}")
 
-            inc = fdf.loc[fdf["kind"]=="income","amount"].sum()
-            exp = fdf.loc[fdf["kind"]=="expense","amount"].sum()
+            totals = read(income_expense, **flt)
+            inc, exp = totals["income"], totals["expense"]
             st.write(f"**Total income:** {inc:.2f} RSD  •  **Total expenses:** {exp:.2f} RSD  •  **Balance (filtered):** {(inc-exp):.2f} RSD")
 
             st.subheader("Total by category")
-            cat_sum = fdf.loc[fdf["kind"]=="expense"].groupby("category")["amount"].sum().sort_values(ascending=False)
-            st.bar_chart(cat_sum)
+            cat_sum = pd.DataFrame(read(totals_by_category, **flt), columns=["category","total"])
+            st.bar_chart(cat_sum.set_index("category")["total"])
 
             st.subheader("Total by month")
-            fdf["month"] = pd.to_datetime(fdf["ts"]).dt.strftime("%Y-%m")
-            month_sum = fdf.loc[fdf["kind"]=="expense"].groupby(["month","category"])["amount"].sum()
-            st.line_chart(month_sum.unstack(fill_value=0))
+            month_sum = pd.DataFrame(read(totals_by_month, **flt), columns=["month","category","total"])
+            st.line_chart(month_sum.pivot(index="month", columns="category", values="total").fillna(0))
         else:
             st.info("No records yet.")
     with tab_rules:
         st.subheader("Auto-categorization Rules")
-        rules = get_all_rules(DB_PATH)
-        import pandas as pd
+        rules = read(get_all_rules)
         df_rules = pd.DataFrame(rules) if rules else pd.DataFrame(columns=["id","pattern","category","enabled","priority"])
 
         edited = st.data_editor(
@@ -218,18 +337,19 @@ if st.session_state.get('authentication_status'):
         colA, colB, colC = st.columns([1,1,1])
         with colA:
             if st.button("💾 Save changes to DB"):
-                for _, row in edited.iterrows():
-                    rid = int(row.get("id")) if pd.notna(row.get("id")) else None
-                    pat = str(row.get("pattern") or "").strip()
-                    cat = str(row.get("category") or "").strip()
-                    en  = 1 if bool(row.get("enabled")) else 0
-                    pr  = int(row.get("priority") or 100)
-                    if not pat or not cat:
-                        continue
-                    if rid:
-                        update_rule(DB_PATH, rid, pat, cat, en, pr)
-                    else:
-                        add_rule(DB_PATH, pat, cat, en, pr)
+                with transaction(DB_PATH):
+                    for _, row in edited.iterrows():
+                        rid = int(row.get("id")) if pd.notna(row.get("id")) else None
+                        pat = str(row.get("pattern") or "").strip()
+                        cat = str(row.get("category") or "").strip()
+                        en  = 1 if bool(row.get("enabled")) else 0
+                        pr  = int(row.get("priority") or 100)
+                        if not pat or not cat:
+                            continue
+                        if rid:
+                            update_rule(DB_PATH, rid, pat, cat, en, pr)
+                        else:
+                            add_rule(DB_PATH, pat, cat, en, pr)
                 st.success("Done. Rules saved.")
 
         with colB:
@@ -244,6 +364,34 @@ if st.session_state.get('authentication_status'):
         with colC:
             st.info("Add new row directly in table (last empty row). Then click «Save changes».")
 
+        st.subheader("Re-categorize history")
+        skip_manual = st.checkbox("Keep categories edited by hand", value=True)
+        reset_unmatched = st.checkbox("Reset rows no rule matches to 'other'", value=False,
+                                      help="e.g. after deleting or narrowing a rule; see Preview first")
+        colP, colR = st.columns([1,1])
+        with colP:
+            if st.button("🔍 Preview"):
+                res = recategorize(DB_PATH, apply=False, skip_manual=skip_manual,
+                                   keep_unmatched=not reset_unmatched)
+                st.write(f"{res['scanned']} rows scanned, {res['changed']} would change "
+                         f"({res['rows_per_sec']:.0f} rows/s)")
+                if res["preview"]:
+                    st.dataframe(pd.DataFrame(res["preview"]), hide_index=True, use_container_width=True)
+        with colR:
+            if st.button("♻️ Apply to history"):
+                res = recategorize(DB_PATH, apply=True, skip_manual=skip_manual,
+                                   keep_unmatched=not reset_unmatched)
+                st.success(f"Updated records: {res['changed']} ({res['rows_per_sec']:.0f} rows/s)")
+
+    if metrics.ENABLED:
+        with st.sidebar.expander("🔧 Pipeline metrics"):
+            snap = metrics.snapshot()
+            st.caption(f"Prometheus: http://127.0.0.1:{_metrics_endpoint()}/metrics")
+            if snap["histograms"]:
+                st.dataframe(pd.DataFrame(snap["histograms"]), hide_index=True, use_container_width=True)
+            if snap["counters"]:
+                st.dataframe(pd.DataFrame(snap["counters"]), hide_index=True, use_container_width=True)
+
 elif st.session_state.get('authentication_status') is False:
     st.error('Username/password is incorrect')
 elif st.session_state.get('authentication_status') is None:
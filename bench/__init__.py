@@ -0,0 +1 @@
+"""Benchmark harness: synthetic receipt corpus, stub portal and timed end-to-end cases (`python -m bench`)."""
@@ -0,0 +1,230 @@
+# bench/corpus.py
+"""
+Synthetic receipt corpus: SUF verification URLs, receipt pages in the portal's two
+layouts (labelled-id spans and a bare <pre> fiscal journal), QR photos encoding the
+URLs and transaction rows. Everything is derived from a seed, so runs are comparable.
+"""
+import base64
+import random
+from datetime import datetime, timedelta
+from html import escape
+
+STORES = [
+    "MAXI DOO", "IDEA DOO", "RODA", "LIDL SRBIJA KD", "VERO", "APOTEKA BENU", "DM DROGERIE MARKT",
+    "LILLY DROGERIE", "NIS PETROL AD", "OMV SRBIJA", "GAZPROM PETROL", "MC DONALDS", "KFC",
+    "PIZZA BAR", "CAFE CENTRAL", "TOSTER BAR", "GRADSKA PEKARA", "MESARA PETROVIC", "TEHNOMANIJA",
+    "GIGATRON", "KNJIZARA VULKAN", "POSTA SRBIJE",
+]
+PRODUCTS = [
+    ("HLEB BELI 500G", 89.99), ("MLEKO 2,8% 1L", 149.99), ("JOGURT 1,5L", 219.0), ("JAJA 10/1", 299.0),
+    ("KAFA GRAND 200G", 389.99), ("BANANE KG", 179.0), ("SAPUN TECNI 500ML", 259.0),
+    ("DETERDZENT ZA SUDOVE PAKOVANJE SA DUGIM NAZIVOM 1L", 329.0), ("VODA NEGAZIRANA 1,5L", 79.0),
+    ("SIR TRAPIST KG", 1299.0), ("BENZIN BMB 95", 189.0), ("HAMBURGER", 450.0),
+]
+PORTAL = "https://suf.purs.gov.rs"
+BASE_TS = datetime(2024, 1, 1, 8, 0, 0)
+
+
+def _money(x: float) -> str:
+    """1234.5 -> '1.234,50' as printed by the portal."""
+    whole, frac = f"{x:.2f}".split(".")
+    return f"{int(whole):,}".replace(",", ".") + "," + frac
+
+
+def receipt(i: int, seed: int = 0) -> dict:
+    """Ground truth for receipt `i`: store, ts, amount and line items."""
+    rng = random.Random(seed * 1_000_003 + i)
+    items = []
+    for _ in range(rng.randint(1, 12)):
+        name, price = rng.choice(PRODUCTS)
+        qty = rng.choice([1, 1, 1, 2, 3])
+        items.append({"name": name, "qty": float(qty), "unit_price": price, "total": round(price * qty, 2),
+                      "vat": rng.choice(["Ђ", "Е"])})
+    ts = BASE_TS + timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+    return {
+        "store": rng.choice(STORES),
+        "ts": ts.isoformat(),
+        "amount": round(sum(it["total"] for it in items), 2),
+        "items": items,
+    }
+
+
+def receipt_url(i: int, base: str = PORTAL) -> str:
+    """SUF verification URL; the `vl` payload encodes the receipt number."""
+    vl = base64.b64encode(f"bench-receipt-{i:08d}".encode()).decode()
+    return f"{base}/v/?vl={vl}"
+
+
+def receipt_index(vl: str) -> int | None:
+    try:
+        return int(base64.b64decode(vl).decode().rsplit("-", 1)[1])
+    except Exception:
+        return None
+
+
+def _journal(r: dict) -> str:
+    ts = datetime.fromisoformat(r["ts"])
+    lines = [
+        "============ ФИСКАЛНИ РАЧУН ============",
+        "ПИБ:                           100000001",
+        r["store"],
+        "Место продаје:             BEOGRAD",
+        "-------------ПРОМЕТ ПРОДАЈА-------------",
+        "Артикли",
+        "========================================",
+        "Назив   Цена         Кол.         Укупно",
+    ]
+    for it in r["items"]:
+        lines.append(f"{it['name']} ({it['vat']})")
+        lines.append(f"{_money(it['unit_price']):>20} {int(it['qty']):>8} {_money(it['total']):>10}")
+    lines += [
+        "----------------------------------------",
+        f"Укупан износ:{_money(r['amount']):>27}",
+        "========================================",
+        f"ПФР време:          {ts.strftime('%d.%m.%Y. %H:%M:%S')}",
+        "======== КРАЈ ФИСКАЛНОГ РАЧУНА =========",
+    ]
+    return "\n".join(lines)
+
+
+def labelled_html(r: dict) -> str:
+    """Portal layout with labelled spans (#shopFullNameLabel, ...) plus the journal."""
+    ts = datetime.fromisoformat(r["ts"]).strftime("%d.%m.%Y. %H:%M:%S")
+    return f"""<!DOCTYPE html>
+<html lang="sr"><head><meta charset="utf-8"><title>Провера рачуна</title>
+<link rel="stylesheet" href="/css/site.css"></head>
+<body><div class="container">
+<div class="row"><div class="col-md-6">
+<label>Предузеће:</label> <span id="shopFullNameLabel">{escape(r['store'])}</span>
+</div></div>
+<div class="row"><div class="col-md-6">
+<label>Укупан износ:</label> <span id="totalAmountLabel">{_money(r['amount'])}</span>
+</div></div>
+<div class="row"><div class="col-md-6">
+<label>ПФР време:</label> <span id="sdcDateTimeLabel">{ts}</span>
+</div></div>
+<div class="row"><pre style="font-family:monospace">{escape(_journal(r))}</pre></div>
+</div></body></html>"""
+
+
+def pre_html(r: dict) -> str:
+    """Older layout: no labelled fields, everything lives in the <pre> journal."""
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Рачун</title></head>
+<body><div class="invoice"><pre>{escape(_journal(r))}</pre></div></body></html>"""
+
+
+LAYOUTS = {"labelled": labelled_html, "pre": pre_html}
+
+
+def page(i: int, layout: str = "labelled", seed: int = 0) -> str:
+    return LAYOUTS[layout](receipt(i, seed))
+
+
+def transactions(n: int, seed: int = 0, with_urls: bool = True, start: int = 0) -> list[dict]:
+    """`n` transaction dicts as insert_tx / insert_many_tx take them, receipts `start`..`start + n - 1`."""
+    rng = random.Random(seed * 1_000_003 + start)
+    out = []
+    for i in range(start, start + n):
+        r = receipt(i, seed)
+        income = rng.random() < 0.05
+        out.append({
+            "ts": r["ts"],
+            "store": r["store"],
+            "amount": r["amount"] * (20 if income else 1),
+            "category": "Salary" if income else rng.choice(["Stores", "Fuel", "Pharmacy", "Household", "other"]),
+            "currency": "RSD",
+            "source": "qr" if with_urls else "manual",
+            "raw_url": receipt_url(i) if with_urls else None,
+            "meta_json": {"source": "bench"},
+            "kind": "income" if income else "expense",
+        })
+    return out
+
+
+LEGAL_FORMS = ["", " DOO", " d.o.o.", " D.O.O.", " AD", " a.d.", ", doo"]
+
+
+def raw_stores(n: int, seed: int = 0, distinct: int = 5000) -> list[str | None]:
+    """
+    `n` store names as they arrive from receipts and imports: a few thousand distinct
+    shop/branch spellings with assorted legal-form suffixes and the odd missing value.
+    """
+    rng = random.Random(seed)
+    pool = [f"{rng.choice(STORES).split(' ')[0]} {rng.choice(['', 'BEOGRAD ', 'NOVI SAD ', 'NIS '])}"
+            f"{rng.randint(1, 400)}{rng.choice(LEGAL_FORMS)}" for _ in range(distinct)]
+    pool.append(None)
+    return [rng.choice(pool) for _ in range(n)]
+
+
+def qr_image(url: str, side: int = 1600, fmt: str = ".jpg", seed: int = 0) -> bytes:
+    """
+    Photo-like image of a QR code: the code covers about a third of a noisy `side` x
+    `side` canvas at a random offset, encoded as JPEG (or PNG) bytes.
+    """
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    code = cv2.QRCodeEncoder.create().encode(url)
+    size = max(code.shape[0], side // 3)
+    code = cv2.resize(code, (size, size), interpolation=cv2.INTER_NEAREST)
+    canvas = rng.normal(200, 25, (side, side)).clip(0, 255).astype(np.uint8)
+    y, x = rng.integers(0, side - size, 2)
+    canvas[y:y + size, x:x + size] = code
+    ok, buf = cv2.imencode(fmt, canvas)
+    if not ok:
+        raise RuntimeError(f"could not encode {fmt}")
+    return buf.tobytes()
+
+
+def large_scan(url: str, width: int, height: int, kind: str = "jpeg", seed: int = 0) -> bytes:
+    """
+    Full-size scan or phone photo (`width` x `height`) with the QR code of `url` in one
+    corner, built in PIL at one byte per pixel: "jpeg" for a camera photo, "tiff1" for a
+    bilevel (mode "1") scanner TIFF, "png" for a lossless grayscale page.
+    """
+    import io
+
+    import cv2
+    from PIL import Image
+
+    rng = random.Random(seed)
+    canvas = Image.effect_noise((width, height), 25).point(lambda v: min(255, v + 72))
+    side = min(width, height) // 4
+    code = Image.fromarray(cv2.QRCodeEncoder.create().encode(url)).resize((side, side), Image.NEAREST)
+    canvas.paste(code, (rng.randint(0, width - side), rng.randint(0, height - side)))
+    buf = io.BytesIO()
+    if kind == "tiff1":
+        canvas.convert("1").save(buf, format="TIFF", compression="group4")
+    elif kind == "png":
+        canvas.save(buf, format="PNG")
+    else:
+        canvas.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def rules(n: int, seed: int = 0) -> list[tuple[str, str, int, int]]:
+    """
+    `n` (pattern, category, enabled, priority) rules in the shapes users write: store
+    names with branch numbers, alternations, optional letters and the odd anchor. Most
+    match nothing in the corpus, the rest match one store family.
+    """
+    rng = random.Random(seed)
+    words = [s.split(" ")[0] for s in STORES]
+    out = []
+    for i in range(n):
+        w = rng.choice(words)
+        shape = rng.randrange(5)
+        if shape == 0:
+            pattern = f"{w} {rng.randint(1, 400)}\\b"
+        elif shape == 1:
+            pattern = f"({w}|{rng.choice(words)}X{i})"
+        elif shape == 2:
+            pattern = f"{w[:-1]}{w[-1]}?{i}"
+        elif shape == 3:
+            pattern = f"^{w} (BEOGRAD|NOVI SAD) {rng.randint(1, 400)}"
+        else:
+            pattern = f"SHOP{i:05d}"
+        out.append((pattern, f"Category {i % 40}", 1, i))
+    return out
@@ -0,0 +1,87 @@
+# bench/stub_server.py
+"""
+Local stand-in for the SUF verification portal: serves corpus receipt pages for
+`/v/?vl=...` URLs built by `corpus.receipt_url`, with optional latency, error rate and
+a number of 503s (with an optional Retry-After) before each receipt is served. Pass a dict as `stats` to watch the
+request count and the highest number of requests in flight at once.
+
+    with stub_portal(layout="pre", delay=0.05) as base:
+        parse_from_url(corpus.receipt_url(7, base))
+"""
+import random
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bench import corpus
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real portal
+    # headers and body go out as separate writes: without TCP_NODELAY, Nagle plus the
+    # client's delayed ACK adds ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.stats["hits"] += 1
+            srv.stats["in_flight"] += 1
+            srv.stats["max_in_flight"] = max(srv.stats["max_in_flight"], srv.stats["in_flight"])
+        try:
+            self._answer(srv)
+        finally:
+            with srv.lock:
+                srv.stats["in_flight"] -= 1
+
+    def _answer(self, srv):
+        if srv.delay:
+            threading.Event().wait(srv.delay)
+        vl = (parse_qs(urlparse(self.path).query).get("vl") or [""])[0]
+        i = corpus.receipt_index(vl)
+        with srv.lock:
+            seen = srv.seen[vl] = srv.seen.get(vl, 0) + 1
+        if seen <= srv.fail_first or (srv.error_rate and srv.rng.random() < srv.error_rate):
+            self._send(503, b"busy", {"Retry-After": str(srv.retry_after)} if srv.retry_after else {})
+        elif i is None:
+            self._send(404, b"unknown receipt")
+        else:
+            self._send(200, corpus.page(i, srv.layout, srv.seed).encode("utf-8"))
+
+    def _send(self, status: int, body: bytes, headers: dict | None = None):
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass   # the client gave up (read timeout) before the delayed answer
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def stub_portal(layout: str = "labelled", delay: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                fail_first: int = 0, retry_after: int = 0, stats: dict | None = None):
+    """Run the stub on a free localhost port; yields its base URL."""
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.daemon_threads = True
+    srv.layout, srv.delay, srv.error_rate, srv.seed = layout, delay, error_rate, seed
+    srv.fail_first, srv.retry_after = fail_first, retry_after
+    srv.rng = random.Random(seed)
+    srv.lock = threading.Lock()
+    srv.seen = {}
+    srv.stats = stats if stats is not None else {}
+    srv.stats.update(hits=0, in_flight=0, max_in_flight=0)
+    thread = threading.Thread(target=srv.serve_forever, name="stub-portal", daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{srv.server_address[1]}"
+    finally:
+        srv.shutdown()
+        srv.server_close()
@@ -0,0 +1,684 @@
+# bench/suite.py
+"""
+End-to-end benchmarks over the synthetic corpus.
+
+    python -m bench --sizes 100,1000,10000 --out bench/results.json
+    python -m bench --cases extract_html,db --baseline bench/results.json
+
+Every case runs at each size and reports min/median wall time and throughput; results
+are written as JSON, and with --baseline the run is compared case by case against an
+earlier file (exit status 1 when a median got slower than --threshold allows).
+
+Cases that verify behaviour as well (`fetch`: retries, timeouts and the per-host cap
+against the stub portal; `ingest`: every receipt saved; `extract_html`: regex fast
+paths agree with BeautifulSoup on every page; `extract_html` and `parse_from_url`:
+store, amount, time and items match the corpus receipt; `categorize_series`: the
+vectorized path gives the scalar categories) mark entries with `passed`; a failed
+check fails the run.
+
+The `qr_memory` case loads full-size uploads (48 MP JPEG, 600 dpi bilevel TIFF, ...)
+through src.qr.iter_pages in fresh interpreters and fails the run when the peak RSS
+growth exceeds --rss-budget-mb.
+
+The `db_scale` case grows one database to 10k, 100k and 1M transactions and times the
+history reads (`list_tx`, paging, range counts, totals) at each step.
+
+The `startup` case imports headless entry points in fresh interpreters under
+`python -X importtime`; it fails the run when one exceeds --import-budget-ms or pulls
+in a heavy dependency (cv2, numpy, pandas, bs4, PIL, requests) at import time.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from bench import corpus
+from bench.stub_server import stub_portal
+
+ROOT = Path(__file__).resolve().parent.parent
+CASES: dict[str, callable] = {}
+UNSIZED: set[str] = set()     # cases that run once instead of at every size
+QR_SIDES = (800, 1600, 4000)
+QR_MAX_IMAGES = 10     # QR decoding is slow; cap images per side regardless of size
+FETCH_MAX = 500        # same for requests against the stub portal
+INGEST_WORKERS = (1, 2, 4, 8, 16)
+INGEST_DELAY = 0.02    # stub portal latency per page for the ingest case, seconds
+DB_SCALE_ROWS = (10_000, 100_000, 1_000_000)
+DB_SCALE_CHUNK = 50_000
+STARTUP_TARGETS = {
+    "receipt": "from src.receipt import parse_from_url",
+    "batch": "import src.batch",
+    "recategorize": "import src.recategorize",
+    "service": "import src.service",
+}
+HEAVY_MODULES = ("cv2", "numpy", "pandas", "bs4", "PIL", "requests", "pyarrow")
+IMPORT_BUDGET_MS = 150
+# full-size uploads for the `qr_memory` case: (width, height, corpus.large_scan kind)
+MEMORY_SCANS = {
+    "jpeg_48mp": (8000, 6000, "jpeg"),
+    "tiff1_a4_600dpi": (4960, 7016, "tiff1"),
+    "png_24mp": (6000, 4000, "png"),
+}
+RSS_BUDGET_MB = 96
+
+
+def case(name: str, sized: bool = True):
+    def register(fn):
+        CASES[name] = fn
+        if not sized:
+            UNSIZED.add(name)
+        return fn
+    return register
+
+
+def measure(fn, items: int = 1, repeat: int = 5, setup=None) -> dict[str, float]:
+    """Time `fn()` `repeat` times (after `setup()`, untimed); stats in ms and items/s."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    med = statistics.median(times)
+    return {
+        "items": items,
+        "repeat": repeat,
+        "min_ms": round(min(times) * 1000, 3),
+        "median_ms": round(med * 1000, 3),
+        "per_item_us": round(med / items * 1e6, 3) if items else 0.0,
+        "items_per_sec": round(items / med, 1) if med > 0 else 0.0,
+    }
+
+
+class Context:
+    def __init__(self, workdir: Path, repeat: int, seed: int):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.seed = seed
+        self._n = 0
+
+    def fresh_db(self) -> Path:
+        self._n += 1
+        return self.workdir / f"bench-{self._n}.db"
+
+
+def _corpus_mismatches(parsed: list[dict], seed: int) -> list[int]:
+    """Receipts whose parsed store, amount, ts or items differ from corpus.receipt (first 20)."""
+    fields = ("store", "amount", "ts", "items")
+    return [i for i, d in enumerate(parsed)
+            if {k: d.get(k) for k in fields} != {k: corpus.receipt(i, seed)[k] for k in fields}][:20]
+
+
+def _soup_journal(html: str) -> str:
+    from bs4 import BeautifulSoup
+    pre = BeautifulSoup(html, "html.parser").find("pre")
+    return pre.get_text() if pre else ""
+
+
+# markup the id scan must not take for the labelled fields; inserted after <body>
+DECOYS = {
+    "data_id": '<span data-id="shopFullNameLabel">WRONG</span>',
+    "comment": '<!-- <span id="totalAmountLabel">0,00</span> -->',
+    "script": "<script>var t = '<span id=\"sdcDateTimeLabel\">01.01.2000. 00:00:00</span>';</script>",
+}
+
+
+@case("extract_html")
+def _bench_extract(size: int, ctx: Context) -> dict:
+    """
+    Regex fast paths vs. BeautifulSoup. Besides the timings, every page of the corpus
+    must come out the same both ways: fields (_extract_fields vs. _extract_soup) and
+    journal text (_journal_text vs. the <pre> text from BeautifulSoup), and match the
+    receipt it was generated from. Fields must also agree on pages carrying DECOYS.
+    """
+    from src.receipt import _extract_fields, _extract_html, _extract_soup, _journal_text
+    out = {}
+    for layout in corpus.LAYOUTS:
+        pages = [corpus.page(i, layout, ctx.seed) for i in range(size)]
+        stats = measure(lambda: [_extract_html(h) for h in pages], size, ctx.repeat)
+        field_diff = [i for i, h in enumerate(pages) if _extract_fields(h) != _extract_soup(h)]
+        journal_diff = [i for i, h in enumerate(pages) if _journal_text(h) != _soup_journal(h)]
+        wrong = _corpus_mismatches([_extract_html(h) for h in pages], ctx.seed)
+        decoy_diff = [i for i, h in enumerate(pages[:100]) for d in DECOYS.values()
+                      if _extract_fields(h.replace("<body>", "<body>" + d)) !=
+                      _extract_soup(h.replace("<body>", "<body>" + d))]
+        stats["checks"] = {"fields_match_soup": not field_diff, "journal_matches_soup": not journal_diff,
+                           "matches_corpus": not wrong, "decoys_match_soup": not decoy_diff}
+        stats["passed"] = all(stats["checks"].values())
+        stats["mismatched_pages"] = sorted(set(field_diff + journal_diff + wrong + decoy_diff))[:20]
+        out[layout] = stats
+        if layout == "labelled":
+            # what the regex fast path saves over the BeautifulSoup fallback
+            out["labelled_soup_only"] = measure(lambda: [_extract_soup(h) for h in pages], size, ctx.repeat)
+    return out
+
+
+@case("parse_from_url")
+def _bench_parse_url(size: int, ctx: Context) -> dict:
+    """
+    parse_from_url against the stub portal without the cache, filling it (cold) and
+    served from it (warm). Every entry checks the results against the corpus; the cold
+    run must leave every page cached, so warm timings are cache hits.
+    """
+    from src.db import cache_stats, close_conns, init_db
+    from src.receipt import parse_from_url
+    n = min(size, FETCH_MAX)
+    out = {}
+    for layout in corpus.LAYOUTS:
+        with stub_portal(layout=layout, seed=ctx.seed) as base:
+            urls = [corpus.receipt_url(i, base) for i in range(n)]
+            target = {"db": None}
+
+            def run():
+                target["parsed"] = [parse_from_url(u, db_path=target["db"]) for u in urls]
+
+            for variant, repeat in (("nocache", ctx.repeat), ("cold", 1), ("warm", ctx.repeat)):
+                if variant == "cold":
+                    target["db"] = ctx.fresh_db()
+                    init_db(target["db"])
+                stats = measure(run, n, repeat)
+                wrong = _corpus_mismatches(target["parsed"], ctx.seed)
+                stats["checks"] = {"matches_corpus": not wrong}
+                if variant == "cold":
+                    stats["checks"]["all_cached"] = cache_stats(target["db"])["entries"] == n
+                stats["passed"] = all(stats["checks"].values())
+                stats["mismatched_pages"] = wrong
+                out[f"{layout}_{variant}"] = stats
+            close_conns()
+    return out
+
+
+def checked(fn, items: int = 1) -> tuple[dict, any]:
+    """(stats of one timed `fn()` call, its return value); callers add `checks`."""
+    t0 = time.perf_counter()
+    value = fn()
+    elapsed = time.perf_counter() - t0
+    return {
+        "items": items,
+        "repeat": 1,
+        "min_ms": round(elapsed * 1000, 3),
+        "median_ms": round(elapsed * 1000, 3),
+        "per_item_us": round(elapsed / items * 1e6, 3) if items else 0.0,
+        "items_per_sec": round(items / elapsed, 1) if elapsed > 0 else 0.0,
+    }, value
+
+
+def _raised(fn) -> Exception | None:
+    try:
+        fn()
+    except Exception as e:
+        return e
+    return None
+
+
+@case("fetch", sized=False)
+def _bench_fetch(size: int, ctx: Context) -> dict:
+    """
+    src.fetch against the stub portal: retries on 5xx, read timeouts (retry count and
+    deadline), a Retry-After longer than the deadline and the per-host concurrency cap.
+    Each entry carries `checks`.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from src import fetch
+    fetch.reset_session()
+    out = {}
+    hits: dict = {}
+    n = 20
+
+    with stub_portal(seed=ctx.seed, fail_first=2, stats=hits) as base:
+        k = 5   # the second retry backs off for about a second
+        stats, pages = checked(lambda: [fetch.fetch_html(corpus.receipt_url(i, base)) for i in range(k)], k)
+        stats["checks"] = {"all_served": all(pages), "three_attempts_each": hits["hits"] == 3 * k}
+        out["retry_5xx"] = stats
+
+    with stub_portal(seed=ctx.seed, fail_first=fetch.MAX_RETRIES + 1, stats=hits) as base:
+        stats, page = checked(lambda: fetch.fetch_html(corpus.receipt_url(0, base)))
+        stats["checks"] = {"gives_up_with_none": page is None, "attempts": hits["hits"] == 1 + fetch.MAX_RETRIES}
+        out["retry_5xx_exhausted"] = stats
+
+    read_timeout = 0.3
+    with stub_portal(seed=ctx.seed, delay=read_timeout * 4, stats=hits) as base:
+        url = corpus.receipt_url(0, base)
+        stats, err = checked(lambda: _raised(lambda: fetch.fetch_html(url, timeout=(1, read_timeout), deadline=5)))
+        stats["checks"] = {"raises": err is not None, "attempts": hits["hits"] == 1 + fetch.READ_RETRIES}
+        out["read_timeout"] = stats
+
+        before = hits["hits"]
+        # a second read timeout would end past the deadline, so no retry is started
+        deadline = read_timeout * 1.5
+        stats, err = checked(lambda: _raised(
+            lambda: fetch.fetch_html(url, timeout=(1, read_timeout), deadline=deadline)))
+        stats["checks"] = {"raises": err is not None, "single_attempt": hits["hits"] - before == 1,
+                           "within_deadline": stats["median_ms"] <= deadline * 1000 + 100}
+        out["read_timeout_deadline"] = stats
+
+    with stub_portal(seed=ctx.seed, fail_first=1, retry_after=5, stats=hits) as base:
+        # backoff plus a read timeout fits the deadline, waiting out the Retry-After does
+        # not: no retry is started
+        deadline = 2
+        stats, page = checked(lambda: fetch.fetch_html(corpus.receipt_url(0, base), timeout=(1, read_timeout),
+                                                       deadline=deadline))
+        stats["checks"] = {"gives_up_with_none": page is None, "single_attempt": hits["hits"] == 1,
+                           "within_deadline": stats["median_ms"] <= deadline * 1000}
+        out["retry_after_deadline"] = stats
+
+    with stub_portal(seed=ctx.seed, delay=0.05, stats=hits) as base:
+        with ThreadPoolExecutor(max_workers=fetch.PER_HOST_LIMIT * 4) as pool:
+            stats, pages = checked(lambda: list(pool.map(fetch.fetch_html,
+                                                         [corpus.receipt_url(i, base) for i in range(n * 4)])), n * 4)
+        stats["checks"] = {"all_served": all(pages), "per_host_cap": hits["max_in_flight"] <= fetch.PER_HOST_LIMIT}
+        stats["max_in_flight"] = hits["max_in_flight"]
+        out["per_host_cap"] = stats
+
+    fetch.reset_session()
+    for stats in out.values():
+        stats["passed"] = all(stats["checks"].values())
+    return out
+
+
+@case("ingest")
+def _bench_ingest(size: int, ctx: Context) -> dict:
+    """
+    src.batch.ingest of receipt URLs from the stub portal (INGEST_DELAY per page) into
+    a fresh database, at each fetch_workers value; items/s is the pipeline throughput.
+    """
+    from src import fetch
+    from src.batch import ingest
+    from src.db import close_conns
+    n = min(size, FETCH_MAX)
+    out = {}
+    with stub_portal(delay=INGEST_DELAY, seed=ctx.seed) as base:
+        urls = [corpus.receipt_url(i, base) for i in range(n)]
+        for workers in INGEST_WORKERS:
+            target = {}
+
+            def new_db():
+                close_conns()
+                target["db"] = ctx.fresh_db()
+
+            def run():
+                target["report"] = ingest(target["db"], urls, fetch_workers=workers, use_processes=False)
+
+            stats = measure(run, n, ctx.repeat, setup=new_db)
+            stats["checks"] = {"all_saved": all(r["status"] == "ok" for r in target["report"])}
+            stats["passed"] = all(stats["checks"].values())
+            out[f"fetch_workers_{workers}"] = stats
+    close_conns()
+    fetch.reset_session()
+    return out
+
+
+@case("parse_from_qr_image")
+def _bench_qr(size: int, ctx: Context) -> dict:
+    from src.receipt import parse_from_qr_image
+    n = min(size, QR_MAX_IMAGES)
+    out = {}
+    for side in QR_SIDES:
+        images = [corpus.qr_image(corpus.receipt_url(i), side, seed=ctx.seed + i) for i in range(n)]
+        found = sum(1 for img in images if parse_from_qr_image(io.BytesIO(img)).get("url"))
+        stats = measure(lambda: [parse_from_qr_image(io.BytesIO(img)) for img in images], n, ctx.repeat)
+        stats["decoded"] = found
+        out[f"{side}px"] = stats
+    return out
+
+
+RULE_COUNTS = (1000, 5000)
+
+
+@case("guess_category")
+def _bench_guess(size: int, ctx: Context) -> dict:
+    """
+    guess_category over `size` stores with the default rules and with RULE_COUNTS
+    generated rules, cold and with the engine's per-store memo filled; it must agree
+    with testing the rules one by one.
+    """
+    import re
+
+    from src.categorize import guess_category, normalize_store, rule_engine
+    from src.db import close_conns, get_all_rules, init_db, transaction
+    stores = corpus.raw_stores(size, ctx.seed)
+    out = {}
+    for n_rules in (0, *RULE_COUNTS):
+        db = ctx.fresh_db()
+        init_db(db)
+        if n_rules:
+            with transaction(db) as conn:
+                conn.execute("DELETE FROM rules")
+                conn.executemany("INSERT INTO rules(pattern, category, enabled, priority) VALUES (?,?,?,?)",
+                                 corpus.rules(n_rules, ctx.seed))
+        name = f"rules_{n_rules}" if n_rules else "default_rules"
+        out[f"{name}_compile"] = measure(lambda: rule_engine(db), 1, 1)   # first call builds the engine
+        # cold every repeat: the engine remembers each store it has answered
+        stats = measure(lambda: [guess_category(s, db=db) for s in stores], size, ctx.repeat,
+                        setup=lambda: rule_engine(db)._memo.clear())
+        out[f"{name}_warm"] = measure(lambda: [guess_category(s, db=db) for s in stores], size, ctx.repeat)
+        naive = [(re.compile(r["pattern"], re.I), r["category"]) for r in get_all_rules(db) if r["enabled"]]
+
+        def one_by_one(store):
+            s = normalize_store(store)
+            return next((cat for rex, cat in naive if s and rex.search(s)), "other")
+        sample = stores[:2000]
+        stats["checks"] = {"same_as_one_by_one": [guess_category(s, db=db) for s in sample] ==
+                           [one_by_one(s) for s in sample]}
+        stats["passed"] = all(stats["checks"].values())
+        out[name] = stats
+        # the pre-engine loop, on the sample only: it is N regex searches per store
+        out[f"{name}_one_by_one"] = measure(lambda: [one_by_one(s) for s in sample], len(sample), 1)
+        close_conns()
+    return out
+
+
+@case("categorize_series")
+def _bench_categorize_series(size: int, ctx: Context) -> dict:
+    """Scalar guess_category per row vs. guess_category_series over the column."""
+    from src.categorize import guess_category, guess_category_series
+    from src.db import close_conns, init_db
+    db = ctx.fresh_db()
+    init_db(db)
+    stores = corpus.raw_stores(size, ctx.seed)
+    guess_category(stores[0], db=db)
+    out = {
+        "scalar": measure(lambda: [guess_category(s, db=db) for s in stores], size, ctx.repeat),
+        "series": measure(lambda: guess_category_series(stores, db=db), size, ctx.repeat),
+    }
+    identical = guess_category_series(stores, db=db).tolist() == [guess_category(s, db=db) for s in stores]
+    out["series"]["checks"] = {"matches_scalar": identical}
+    out["series"]["passed"] = identical
+    out["series"]["speedup"] = round(out["scalar"]["median_ms"] / out["series"]["median_ms"], 1)
+    close_conns()
+    return out
+
+
+@case("db")
+def _bench_db(size: int, ctx: Context) -> dict:
+    from src import db as D
+    txs = corpus.transactions(size, ctx.seed)
+    out = {}
+    target = {}
+
+    def new_db():
+        D.close_conns()
+        target["db"] = ctx.fresh_db()
+        D.init_db(target["db"])
+
+    out["insert_many_tx"] = measure(lambda: D.insert_many_tx(target["db"], txs), size, ctx.repeat, setup=new_db)
+    db = target["db"]
+
+    extra = corpus.transactions(size + 200, ctx.seed + 1)[size:]
+    for i, t in enumerate(extra):
+        t["raw_url"] = corpus.receipt_url(10_000_000 + i)
+    rows = iter(extra)
+    out["insert_tx"] = measure(lambda: D.insert_tx(db, next(rows)), 1, min(200, ctx.repeat * 20))
+
+    mid = date.fromisoformat(txs[len(txs) // 2]["ts"][:10]) if txs else date.today()
+    reads = {
+        "list_tx": lambda: D.list_tx(db),
+        "query_tx_page": lambda: D.query_tx(db, limit=500),
+        "count_tx": lambda: D.count_tx(db),
+        "count_tx_range": lambda: D.count_tx(db, date_from=mid),
+        "totals_by_category": lambda: D.totals_by_category(db),
+        "totals_by_month": lambda: D.totals_by_month(db),
+        "income_expense": lambda: D.income_expense(db),
+        "income_expense_range": lambda: D.income_expense(db, date_from=mid),
+        "current_balance": lambda: D.current_balance(db),
+        "tx_bounds": lambda: D.tx_bounds(db),
+    }
+    for name, fn in reads.items():
+        out[name] = measure(fn, 1, ctx.repeat)
+    D.close_conns()
+    return out
+
+
+@case("db_scale", sized=False)
+def _bench_db_scale(size: int, ctx: Context) -> dict:
+    """History reads as one database grows through DB_SCALE_ROWS, filled in chunks."""
+    from src import db as D
+    db = ctx.fresh_db()
+    D.init_db(db)
+    out = {}
+    filled = 0
+    for rows in DB_SCALE_ROWS:
+        while filled < rows:
+            n = min(DB_SCALE_CHUNK, rows - filled)
+            D.insert_many_tx(db, corpus.transactions(n, ctx.seed, start=filled))
+            filled += n
+        mid = date.fromisoformat(D.tx_bounds(db)[0][:10]) + timedelta(days=180)
+        reads = {
+            "list_tx": lambda: D.list_tx(db),
+            "query_tx_page": lambda: D.query_tx(db, limit=500),
+            "query_tx_deep_page": lambda: D.query_tx(db, limit=500, offset=rows // 2),
+            "count_tx_range": lambda: D.count_tx(db, date_from=mid),
+            "totals_by_category": lambda: D.totals_by_category(db),
+            "income_expense_range": lambda: D.income_expense(db, date_from=mid),
+        }
+        for name, fn in reads.items():
+            out[f"{name}@{rows}"] = measure(fn, 1, ctx.repeat)
+        print(f"db_scale: {rows} rows", file=sys.stderr)
+    D.close_conns()
+    return out
+
+
+_RSS_PROBE = """
+import json, resource, sys
+from src.qr import iter_pages
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+with open(sys.argv[1], "rb") as f:
+    pages = [list(p.shape) for p in iter_pages(f)]
+print(json.dumps({"before": before, "peak": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "pages": pages}))
+"""
+
+
+def rss_profile(path: Path) -> tuple[float, float, list]:
+    """(wall ms, peak RSS growth in MB, page shapes) for loading `path` in a fresh interpreter."""
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", _RSS_PROBE, str(path)], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    ms = (time.perf_counter() - t0) * 1000
+    probe = json.loads(proc.stdout)
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024   # ru_maxrss: bytes on macOS, KiB elsewhere
+    return ms, (probe["peak"] - probe["before"]) / unit, probe["pages"]
+
+
+@case("qr_memory", sized=False)
+def _bench_qr_memory(size: int, ctx: Context) -> dict:
+    out = {}
+    for name, (w, h, kind) in MEMORY_SCANS.items():
+        path = ctx.workdir / f"scan-{name}"
+        path.write_bytes(corpus.large_scan(corpus.receipt_url(0), w, h, kind, ctx.seed))
+        runs = [rss_profile(path) for _ in range(ctx.repeat)]
+        times = sorted(ms for ms, _, _ in runs)
+        med = statistics.median(times)
+        out[name] = {
+            "items": 1,
+            "repeat": ctx.repeat,
+            "min_ms": round(times[0], 3),
+            "median_ms": round(med, 3),
+            "per_item_us": round(med * 1000, 3),
+            "items_per_sec": round(1000 / med, 1) if med > 0 else 0.0,
+            "pixels": w * h,
+            "peak_rss_mb": round(max(mb for _, mb, _ in runs), 1),
+            "pages": runs[0][2],
+        }
+        path.unlink()
+    return out
+
+
+def import_profile(stmt: str) -> tuple[float, list[str]]:
+    """
+    (ms spent importing for `stmt` in a fresh interpreter, heavy top-level packages it
+    loaded), from `python -X importtime`; interpreter startup itself is not counted.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", stmt], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    total_us, loaded = 0, set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue   # header line
+        module = name.strip()
+        loaded.add(module.split(".")[0])
+        if len(name) - len(name.lstrip()) == 1:   # top-level entry, its cumulative time covers the nested ones
+            total_us += int(cumulative)
+    return total_us / 1000, sorted(loaded & set(HEAVY_MODULES))
+
+
+@case("startup", sized=False)
+def _bench_startup(size: int, ctx: Context) -> dict:
+    base = min(import_profile("pass")[0] for _ in range(ctx.repeat))
+    out = {}
+    for name, stmt in STARTUP_TARGETS.items():
+        runs = [import_profile(stmt) for _ in range(ctx.repeat)]
+        times = sorted(max(0.0, ms - base) for ms, _ in runs)
+        med = statistics.median(times)
+        out[name] = {
+            "items": 1,
+            "repeat": ctx.repeat,
+            "min_ms": round(times[0], 3),
+            "median_ms": round(med, 3),
+            "per_item_us": round(med * 1000, 3),
+            "items_per_sec": round(1000 / med, 1) if med > 0 else 0.0,
+            "heavy_modules": runs[0][1],
+        }
+    return out
+
+
+def over_budget(res: dict, budget_ms: float) -> list[str]:
+    """Startup entries slower than `budget_ms` or importing heavy modules."""
+    bad = []
+    for name, by_size in res["results"].items():
+        if not name.startswith("startup."):
+            continue
+        for s in by_size.values():
+            if s["median_ms"] > budget_ms or s["heavy_modules"]:
+                bad.append(f"{name}: {s['median_ms']:.1f} ms (budget {budget_ms:.0f}), "
+                           f"heavy imports: {', '.join(s['heavy_modules']) or 'none'}")
+    return bad
+
+
+def failed_checks(res: dict) -> list[str]:
+    """Entries whose correctness checks (`passed`, set by e.g. fetch or extract_html) failed."""
+    return [f"{name} @ {size}: " + ", ".join(k for k, ok in s.get("checks", {}).items() if not ok)
+            for name, by_size in res["results"].items() for size, s in by_size.items()
+            if s.get("passed") is False]
+
+
+def over_rss_budget(res: dict, budget_mb: float) -> list[str]:
+    """qr_memory entries whose peak RSS growth exceeds `budget_mb`."""
+    bad = []
+    for name, by_size in res["results"].items():
+        if not name.startswith("qr_memory."):
+            continue
+        for s in by_size.values():
+            if s["peak_rss_mb"] > budget_mb:
+                bad.append(f"{name}: peak RSS +{s['peak_rss_mb']:.1f} MB (budget {budget_mb:.0f} MB) "
+                           f"for {s['pixels'] / 1e6:.0f} MP")
+    return bad
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(cases: list[str], sizes: list[int], repeat: int = 5, seed: int = 0) -> dict:
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="receipts-bench-") as tmp:
+        ctx = Context(Path(tmp), repeat, seed)
+        for name in cases:
+            for size in ([0] if name in UNSIZED else sizes):
+                started = time.perf_counter()
+                for variant, stats in CASES[name](size, ctx).items():
+                    results.setdefault(f"{name}.{variant}", {})[str(size)] = stats
+                print(f"{name} @ {size}: {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "sizes": sizes,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[dict]:
+    """Rows for every case/size present in both runs; `regression` when slower than 1 + threshold."""
+    rows = []
+    for name, by_size in current["results"].items():
+        for size, stats in by_size.items():
+            old = baseline.get("results", {}).get(name, {}).get(size)
+            if not old or not old.get("median_ms"):
+                continue
+            ratio = stats["median_ms"] / old["median_ms"]
+            rows.append({"case": name, "size": size, "old_ms": old["median_ms"], "new_ms": stats["median_ms"],
+                         "ratio": round(ratio, 3), "regression": ratio > 1 + threshold})
+    return rows
+
+
+def _print_results(res: dict):
+    for name, by_size in res["results"].items():
+        for size, s in by_size.items():
+            print(f"{name:<40} {size:>7} {s['median_ms']:>11.3f} ms {s['per_item_us']:>11.1f} us/item "
+                  f"{s['items_per_sec']:>11.1f}/s")
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench", description="Receipt pipeline benchmarks")
+    ap.add_argument("--cases", default=",".join(CASES), help=f"comma-separated subset of: {', '.join(CASES)}")
+    ap.add_argument("--sizes", default="100,1000,10000")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", type=Path, help="write results JSON here")
+    ap.add_argument("--baseline", type=Path, help="earlier results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before a case counts as regressed")
+    ap.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                    help="startup case: max import time per entry point")
+    ap.add_argument("--rss-budget-mb", type=float, default=RSS_BUDGET_MB,
+                    help="qr_memory case: max peak RSS growth per upload")
+    args = ap.parse_args(argv)
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        ap.error(f"unknown case(s): {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    res = run(cases, sizes, args.repeat, args.seed)
+    _print_results(res)
+    if args.out:
+        args.out.write_text(json.dumps(res, indent=2), encoding="utf-8")
+
+    failed = False
+    for msg in over_budget(res, args.import_budget_ms) + over_rss_budget(res, args.rss_budget_mb):
+        print(f"OVER BUDGET {msg}")
+        failed = True
+    for msg in failed_checks(res):
+        print(f"FAILED {msg}")
+        failed = True
+    if not args.baseline:
+        return 1 if failed else 0
+    rows = compare(res, json.loads(args.baseline.read_text(encoding="utf-8")), args.threshold)
+    for r in rows:
+        flag = "REGRESSION" if r["regression"] else ""
+        print(f"{r['case']:<40} {r['size']:>7} {r['old_ms']:>11.3f} -> {r['new_ms']:>11.3f} ms "
+              f"x{r['ratio']:.2f} {flag}")
+    return 1 if failed or any(r["regression"] for r in rows) else 0
@@ -0,0 +1,160 @@
+# src/batch.py
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from src.categorize import categorize_items, guess_category, normalize_store
+from src.db import add_db_args, existing_receipt_keys, init_db, insert_many_tx, resolve_db, tx_receipt_key
+from src.receipt import parse_from_qr_image, parse_from_url
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+def collect_sources(path: Path) -> list[str]:
+    """
+    Folder -> all images inside; image file -> itself; any other file -> one URL per line.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return [str(p) for p in sorted(path.iterdir()) if p.suffix.lower() in IMAGE_EXTS]
+    if path.suffix.lower() in IMAGE_EXTS:
+        return [str(path)]
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                out.append(line)
+    return out
+
+
+def _is_url(src: str) -> bool:
+    return src.startswith(("http://", "https://"))
+
+
+def _decode_one(src: str) -> dict:
+    with open(src, "rb") as f:
+        return parse_from_qr_image(f)
+
+
+def tx_from_receipt(p: dict, url: str | None, db_path: Path | None = None, mode: str = "batch") -> dict | None:
+    store = normalize_store(p.get("store") or "")
+    amount = p.get("amount")
+    if not store or not amount:
+        return None
+    try:
+        ts = datetime.fromisoformat(p.get("ts") or "").isoformat()
+    except ValueError:
+        ts = datetime.now().isoformat()
+    return {
+        "ts": ts,
+        "store": store,
+        "amount": float(amount),
+        "category": guess_category(store, db=db_path),
+        "currency": "RSD",
+        "source": "qr" if url else "manual",
+        "raw_url": url or None,
+        "meta_json": {"source": mode},
+        "kind": "expense",
+        "items": categorize_items(p.get("items"), db_path),
+    }
+
+
+def _resolve_one(src: str, url: str, db_path: Path) -> dict:
+    status = {"source": src, "url": url, "status": "failed", "error": None}
+    try:
+        p = parse_from_url(url, db_path=db_path, strict=True)
+    except Exception as e:
+        status["error"] = f"fetch: {e}"
+        return status
+    t = tx_from_receipt(p, url, db_path)
+    if t is None:
+        status["error"] = "store/amount not found"
+        return status
+    status.update(status="ok", tx=t)
+    return status
+
+
+def ingest(db_path: Path, sources: list[str], fetch_workers: int = 8, decode_workers: int = 2,
+           use_processes: bool = True) -> list[dict]:
+    """
+    Decode QR codes (process pool), fetch and parse receipt pages (thread pool) and
+    save every resolved receipt with a single bulk insert. Returns one status per source.
+    """
+    init_db(db_path)
+    report: list[dict | None] = [None] * len(sources)
+    urls: dict[int, str] = {}
+
+    images = [(i, s) for i, s in enumerate(sources) if not _is_url(s)]
+    for i, s in enumerate(sources):
+        if _is_url(s):
+            urls[i] = s
+    if images:
+        pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool_cls(max_workers=max(1, decode_workers)) as pool:
+            futures = [(i, s, pool.submit(_decode_one, s)) for i, s in images]
+            for i, s, fut in futures:
+                try:
+                    data = fut.result().get("url")
+                except Exception as e:
+                    report[i] = {"source": s, "url": None, "status": "failed", "error": f"decode: {e}"}
+                    continue
+                if data:
+                    urls[i] = data
+                else:
+                    report[i] = {"source": s, "url": None, "status": "failed", "error": "QR not found"}
+
+    with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as pool:
+        futures = {i: pool.submit(_resolve_one, sources[i], u, db_path) for i, u in urls.items()}
+        for i, fut in futures.items():
+            report[i] = fut.result()
+
+    # same receipt already stored, or listed twice in this batch
+    ok = [r for r in report if r["status"] == "ok"]
+    stored = existing_receipt_keys(db_path, [tx_receipt_key(r["tx"]) for r in ok])
+    txs = []
+    for r in ok:
+        t = r.pop("tx")
+        key = tx_receipt_key(t)
+        if key in stored:
+            r.update(status="duplicate", error="receipt already saved")
+            continue
+        if key:
+            stored.add(key)
+        txs.append(t)
+    insert_many_tx(db_path, txs)
+    return report
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Bulk receipt ingestion from a folder of images or a file of URLs")
+    ap.add_argument("source", type=Path, help="folder with receipt images, an image, or a text file with one URL per line")
+    add_db_args(ap)
+    ap.add_argument("--fetch-workers", type=int, default=8)
+    ap.add_argument("--decode-workers", type=int, default=2)
+    ap.add_argument("--report", type=Path, help="write per-item status report (JSON) here")
+    args = ap.parse_args(argv)
+
+    args.db = resolve_db(args.db, args.user)
+    sources = collect_sources(args.source)
+    started = time.perf_counter()
+    report = ingest(args.db, sources, fetch_workers=args.fetch_workers, decode_workers=args.decode_workers)
+    elapsed = time.perf_counter() - started
+
+    ok = sum(1 for r in report if r["status"] == "ok")
+    for r in report:
+        if r["status"] != "ok":
+            print(f"{r['status'].upper()} {r['source']}: {r['error']}", file=sys.stderr)
+    rate = len(report) / elapsed if elapsed > 0 else 0.0
+    print(f"{ok}/{len(report)} saved in {elapsed:.2f}s ({rate:.1f} items/s)")
+    if args.report:
+        args.report.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0 if all(r["status"] != "failed" for r in report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
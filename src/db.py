@@ -1,13 +1,98 @@
+import argparse
+import hashlib
+import os
+import re
 import sqlite3
 import json
+import logging
+import sys
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
-def get_conn(db_path: Path):
-    return sqlite3.connect(db_path)
+from src import metrics
+from src.identity import receipt_key
 
-def init_db(db_path: Path):
+log = logging.getLogger(__name__)
+_local = threading.local()
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # readers never block the writer and vice versa
+    "PRAGMA synchronous=NORMAL",    # fsync on checkpoint only; safe with WAL
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-32000",     # 32 MB page cache per connection
+    "PRAGMA busy_timeout=10000",
+    "PRAGMA foreign_keys=ON",
+)
+
+def get_conn(db_path: Path) -> sqlite3.Connection:
+    """
+    Connection for the current thread, opened once per database and reused.
+    Runs in autocommit mode; group writes with `transaction()`.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = str(db_path)
+    conn = conns.get(key)
+    if conn is None:
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        # lets UPDATEs keep transactions.receipt_key in step with the columns it is built from
+        conn.create_function("receipt_key", 4, receipt_key, deterministic=True)
+        conns[key] = conn
+    return conn
+
+def close_conns():
+    """Close every connection opened by the current thread."""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+@contextmanager
+def transaction(db_path: Path):
+    """
+    One write transaction on the thread's connection; commits on success, rolls back
+    on error. Nested use joins the outer transaction, so multi-row writes made through
+    the functions below share a single commit.
+    """
     conn = get_conn(db_path)
-    cur = conn.cursor()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+_watchers: dict[str, sqlite3.Connection] = {}
+_watch_lock = threading.Lock()
+
+def data_version(db_path: Path) -> int:
+    """
+    Changes whenever any connection - in this process or another one - commits to the
+    database. Read on a dedicated connection that never writes, so commits made through
+    `get_conn` count as well; cheap enough to key read caches on.
+    """
+    key = str(db_path)
+    with _watch_lock:
+        conn = _watchers.get(key)
+        if conn is None:
+            conn = _watchers[key] = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        return conn.execute("PRAGMA data_version").fetchone()[0]
+
+def _columns(cur, table: str) -> set[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return {r[1] for r in cur.fetchall()}
+
+def _m001_base(cur):
     cur.execute('''
 CREATE TABLE IF NOT EXISTS transactions (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,10 +113,12 @@ CREATE TABLE IF NOT EXISTS rules (
   enabled INTEGER NOT NULL DEFAULT 1,
   priority INTEGER NOT NULL DEFAULT 100
 );''')
-    try:
+    cols = _columns(cur, "transactions")
+    if "kind" not in cols:
         cur.execute("ALTER TABLE transactions ADD COLUMN kind TEXT NOT NULL DEFAULT 'expense'")
-    except Exception:
-        pass
+    if "category_manual" not in cols:
+        # 1 = category was set by hand, bulk re-categorization leaves the row alone
+        cur.execute("ALTER TABLE transactions ADD COLUMN category_manual INTEGER NOT NULL DEFAULT 0")
     cur.execute("SELECT COUNT(*) FROM rules")
     (cnt,) = cur.fetchone()
     if (cnt or 0) == 0:
@@ -44,88 +131,689 @@ CREATE TABLE IF NOT EXISTS rules (
         ]
         cur.executemany("INSERT INTO rules(pattern, category, enabled, priority) VALUES (?,?,?,?)",
                         DEFAULT_RULES_SEED)
-    conn.commit()
-    conn.close()
 
-def insert_tx(db_path: Path, t: dict[str, any]):
+def _m002_indexes(cur):
+    # older databases may hold the same receipt twice. The unique index below keeps the
+    # URL on the first copy; later copies stay in place, and their URL is moved to
+    # duplicate_raw_urls (see `duplicate_urls`) instead of being dropped.
+    cur.execute("UPDATE transactions SET raw_url=NULL WHERE raw_url=''")
+    cur.execute('''
+CREATE TABLE IF NOT EXISTS duplicate_raw_urls (
+  tx_id INTEGER PRIMARY KEY,
+  raw_url TEXT NOT NULL,
+  kept_tx_id INTEGER NOT NULL
+);''')
+    cur.execute("""INSERT OR IGNORE INTO duplicate_raw_urls(tx_id, raw_url, kept_tx_id)
+                   SELECT t.id, t.raw_url, k.kept FROM transactions t
+                   JOIN (SELECT raw_url, MIN(id) AS kept FROM transactions
+                         WHERE raw_url IS NOT NULL GROUP BY raw_url HAVING COUNT(*) > 1) k
+                     ON k.raw_url = t.raw_url
+                   WHERE t.id != k.kept""")
+    if cur.rowcount > 0:
+        log.warning("%d transaction(s) share a receipt URL with an earlier one; their URLs were moved "
+                    "to duplicate_raw_urls (python -m src.db duplicates)", cur.rowcount)
+        cur.execute("UPDATE transactions SET raw_url=NULL WHERE id IN (SELECT tx_id FROM duplicate_raw_urls)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_tx_ts ON transactions(ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_tx_category_ts ON transactions(category, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_tx_kind_ts ON transactions(kind, ts)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_tx_raw_url ON transactions(raw_url) WHERE raw_url IS NOT NULL")
+
+def _rollup_delta(row: str, sign: str) -> str:
+    """Trigger body fragment adding (sign='+') or removing (sign='-') one row from the rollups."""
+    return f"""
+  INSERT INTO monthly_rollup(month, category, kind, total, cnt)
+    VALUES (substr({row}.ts, 1, 7), {row}.category, {row}.kind, {sign}{row}.amount, {sign}1)
+    ON CONFLICT(month, category, kind) DO UPDATE SET total = total + excluded.total, cnt = cnt + excluded.cnt;
+  DELETE FROM monthly_rollup
+    WHERE month = substr({row}.ts, 1, 7) AND category = {row}.category AND kind = {row}.kind AND cnt = 0;
+  UPDATE balance_rollup SET
+    income = income + CASE WHEN {row}.kind = 'income' THEN {sign}{row}.amount ELSE 0 END,
+    expense = expense + CASE WHEN {row}.kind = 'expense' THEN {sign}{row}.amount ELSE 0 END,
+    cnt = cnt + {sign}1
+    WHERE id = 1;"""
+
+def _m003_rollups(cur):
+    cur.execute('''
+CREATE TABLE IF NOT EXISTS monthly_rollup (
+  month TEXT NOT NULL,
+  category TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  total REAL NOT NULL DEFAULT 0,
+  cnt INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (month, category, kind)
+) WITHOUT ROWID;''')
+    cur.execute('''
+CREATE TABLE IF NOT EXISTS balance_rollup (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  income REAL NOT NULL DEFAULT 0,
+  expense REAL NOT NULL DEFAULT 0,
+  cnt INTEGER NOT NULL DEFAULT 0
+);''')
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_tx_rollup_ins AFTER INSERT ON transactions BEGIN"
+                f"{_rollup_delta('NEW', '+')}\nEND")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_tx_rollup_del AFTER DELETE ON transactions BEGIN"
+                f"{_rollup_delta('OLD', '-')}\nEND")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_tx_rollup_upd AFTER UPDATE OF ts, category, kind, amount "
+                f"ON transactions BEGIN{_rollup_delta('OLD', '-')}{_rollup_delta('NEW', '+')}\nEND")
+    _rebuild_rollups(cur)
+
+def _m004_receipt_key(cur):
+    if "receipt_key" not in _columns(cur, "transactions"):
+        cur.execute("ALTER TABLE transactions ADD COLUMN receipt_key TEXT")
+    seen: set[str] = set()
+    keys = []
+    cur.execute("SELECT id, raw_url, store, ts, amount FROM transactions ORDER BY id")
+    for tx_id, raw_url, store, ts, amount in cur.fetchall():
+        key = receipt_key(raw_url, store, ts, amount)
+        if key in seen:
+            key = None   # an earlier row already holds this receipt
+        elif key:
+            seen.add(key)
+        keys.append((key, tx_id))
+    cur.executemany("UPDATE transactions SET receipt_key=? WHERE id=?", keys)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_tx_receipt_key ON transactions(receipt_key) "
+                "WHERE receipt_key IS NOT NULL")
+
+def _m005_items(cur):
+    cur.execute('''
+CREATE TABLE IF NOT EXISTS transaction_items (
+  tx_id INTEGER NOT NULL REFERENCES transactions(id) ON DELETE CASCADE,
+  pos INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  qty REAL NOT NULL,
+  unit_price REAL NOT NULL,
+  total REAL NOT NULL,
+  vat TEXT,
+  category TEXT,
+  PRIMARY KEY (tx_id, pos)
+) WITHOUT ROWID;''')
+
+def _m006_rules_version(cur):
+    # bumped by triggers inside the writing transaction: the new value becomes visible
+    # together with the rule change, whichever process or connection made it
+    cur.execute('''
+CREATE TABLE IF NOT EXISTS rules_version (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL DEFAULT 0
+);''')
+    cur.execute("INSERT OR IGNORE INTO rules_version(id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_rules_version_{event.lower()} AFTER {event} ON rules "
+                    f"BEGIN UPDATE rules_version SET version = version + 1 WHERE id = 1; END")
+
+# Schema steps, applied in order; PRAGMA user_version stores how many already ran.
+# Never edit a released step - append a new one.
+MIGRATIONS = [
+    _m001_base,
+    _m002_indexes,
+    _m003_rollups,
+    _m004_receipt_key,
+    _m005_items,
+    _m006_rules_version,
+]
+
+def _a001_cache_jobs(cur):
+    cur.execute('''
+CREATE TABLE IF NOT EXISTS receipt_cache (
+  url_key TEXT PRIMARY KEY,
+  html_z BLOB NOT NULL,
+  data_json TEXT NOT NULL,
+  parser_version INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  hits INTEGER NOT NULL DEFAULT 0,
+  fetched_at TEXT NOT NULL,
+  accessed_at TEXT NOT NULL
+);''')
+    cur.execute('''
+CREATE TABLE IF NOT EXISTS jobs (
+  id TEXT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  payload BLOB NOT NULL,
+  status TEXT NOT NULL,
+  result_json TEXT,
+  error TEXT,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL
+);''')
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs(status, created_at)")
+
+# Same scheme for the sidecar database.
+AUX_MIGRATIONS = [
+    _a001_cache_jobs,
+]
+
+def aux_db_path(db_path: Path) -> Path:
+    """
+    Sidecar database next to `db_path` (receipts.db -> receipts.aux.db) holding the
+    receipt cache and the service's jobs. Their writes - one per cache hit, several per
+    job - would otherwise change `data_version` of the main file and drop every cached
+    UI read with them.
+    """
+    p = Path(db_path)
+    return p.with_name(f"{p.stem}.aux{p.suffix}")
+
+def migrate(db_path: Path, steps: list = MIGRATIONS) -> int:
+    """Run pending schema migrations; returns the resulting schema version."""
     conn = get_conn(db_path)
-    cur = conn.cursor()
-    cur.execute(
-        """INSERT INTO transactions(ts,store,amount,currency,category,source,raw_url,meta_json,kind)
-           VALUES (?,?,?,?,?,?,?,?,?)""",
-        (
-            t["ts"], t["store"], t["amount"], t.get("currency","RSD"),
-            t["category"], t.get("source","qr"), t.get("raw_url"),
-            json.dumps(t.get("meta_json")) if t.get("meta_json") is not None else None,
-            t.get("kind","expense")
-        )
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    if version >= len(steps):
+        return version
+    with transaction(db_path) as conn:
+        # re-read under the write lock: another process may have migrated meanwhile
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        cur = conn.cursor()
+        for i, step in enumerate(steps[version:], start=version + 1):
+            step(cur)
+            cur.execute(f"PRAGMA user_version={i}")
+    return len(steps)
+
+def init_db(db_path: Path):
+    migrate(aux_db_path(db_path), AUX_MIGRATIONS)
+    migrate(db_path)
+
+def rules_version(db_path: Path) -> int:
+    """Committed revision of the rules table (see _m006_rules_version); keys compiled rule sets."""
+    row = get_conn(db_path).execute("SELECT version FROM rules_version WHERE id=1").fetchone()
+    return row[0] if row else 0
+
+DATA_DIR = Path("data")   # app and command-line tools
+LEGACY_DB = "receipts.db"
+_SHARD_LOCK = threading.Lock()
+
+def user_db_path(data_dir: Path, username: str) -> Path:
+    """
+    One SQLite file per user under data_dir/users. The readable part of the name is
+    sanitized; the hash keeps names that sanitize alike (or differ in case) apart.
+    """
+    slug = re.sub(r"[^a-z0-9_-]+", "_", username.strip().lower()).strip("_")[:40] or "user"
+    digest = hashlib.sha1(username.encode("utf-8")).hexdigest()[:10]
+    return Path(data_dir) / "users" / f"{slug}-{digest}.db"
+
+def init_user_db(data_dir: Path, username: str) -> Path:
+    """
+    Path of the user's database, created and migrated on first use with the default
+    rules (rules are per user). The single pre-sharding database, data_dir/receipts.db,
+    is copied into the shard of the user named by RECEIPTS_LEGACY_OWNER; creating any
+    other user's shard while it exists logs a warning.
+    """
+    path = user_db_path(data_dir, username)
+    with _SHARD_LOCK:
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            legacy = Path(data_dir) / LEGACY_DB
+            owner = os.environ.get("RECEIPTS_LEGACY_OWNER")
+            if legacy.exists() and owner != username:
+                log.warning("%s is not copied into the new database of %r (RECEIPTS_LEGACY_OWNER=%s); "
+                            "restart with RECEIPTS_LEGACY_OWNER=<username> before that user first signs in "
+                            "to keep its history", legacy, username, owner or "unset")
+            if legacy.exists() and owner == username:
+                for src_path, dst_path in ((legacy, path), (aux_db_path(legacy), aux_db_path(path))):
+                    if not src_path.exists():
+                        continue
+                    src = sqlite3.connect(src_path)
+                    dst = sqlite3.connect(dst_path)
+                    try:
+                        src.backup(dst)   # consistent copy even while the legacy file is in use
+                    finally:
+                        dst.close()
+                        src.close()
+        init_db(path)
+    return path
+
+def add_db_args(ap: argparse.ArgumentParser):
+    """--db/--user for the command-line tools; one of them is required (see `resolve_db`)."""
+    g = ap.add_mutually_exclusive_group(required=True)
+    g.add_argument("--db", type=Path, help="database file")
+    g.add_argument("--user", help=f"work on this user's database ({DATA_DIR}/users/...), as the app does")
+
+def resolve_db(db: Path | None, user: str | None) -> Path:
+    """
+    CLI --db/--user pair -> database file: the user's shard under DATA_DIR when a user
+    is given. A missing DATA_DIR/receipts.db is not created: the app never reads it, and
+    its presence would be taken for pre-sharding data when user databases are created.
+    """
+    if user:
+        return init_user_db(DATA_DIR, user)
+    db = Path(db)
+    if not db.exists() and db.resolve() == (DATA_DIR / LEGACY_DB).resolve():
+        raise SystemExit(f"{db} does not exist and is not created: user data lives in {DATA_DIR}/users, "
+                         "pass --user <username>")
+    return db
+
+def tx_receipt_key(t: dict[str, any]) -> str | None:
+    # an explicit key, None included, wins: imports carry the key the row was stored with
+    if "receipt_key" in t:
+        return t["receipt_key"]
+    return receipt_key(t.get("raw_url"), t.get("store"), t.get("ts"), t.get("amount"))
+
+def _tx_row(t: dict[str, any]) -> tuple:
+    return (
+        t["ts"], t["store"], t["amount"], t.get("currency","RSD"),
+        t["category"], t.get("source","qr"), t.get("raw_url"),
+        json.dumps(t.get("meta_json")) if t.get("meta_json") is not None else None,
+        t.get("kind","expense"), int(bool(t.get("category_manual"))), tx_receipt_key(t)
     )
-    conn.commit()
-    conn.close()
 
-def update_tx(db_path, tx_id, **fields):
-    if not fields:
-        return
-    allowed = {"ts","store","amount","currency","category","kind","source","raw_url","meta_json"}
-    cols = [k for k in fields.keys() if k in allowed]
-    vals = [fields[k] for k in cols]
-    sets = ", ".join(f"{k}=?" for k in cols)
+_INSERT_TX = """INSERT INTO transactions(ts,store,amount,currency,category,source,raw_url,meta_json,kind,category_manual,receipt_key)
+           VALUES (?,?,?,?,?,?,?,?,?,?,?)"""
+
+_UPSERT_TX = _INSERT_TX + """
+           ON CONFLICT(receipt_key) WHERE receipt_key IS NOT NULL DO UPDATE SET
+             ts=excluded.ts, store=excluded.store, amount=excluded.amount, currency=excluded.currency,
+             category=excluded.category, source=excluded.source, raw_url=excluded.raw_url,
+             meta_json=excluded.meta_json, kind=excluded.kind, category_manual=excluded.category_manual"""
+
+def insert_tx(db_path: Path, t: dict[str, any], on_conflict: str = "skip") -> int | None:
+    """
+    Insert one transaction and return its id. When the same receipt (see
+    src.identity.receipt_key) is already stored: "skip" returns None, "update"
+    overwrites the stored row and returns its id, "error" raises sqlite3.IntegrityError.
+    """
+    sql = {"skip": _INSERT_TX + " ON CONFLICT DO NOTHING", "update": _UPSERT_TX, "error": _INSERT_TX}[on_conflict]
+    with metrics.timer("receipt_stage_seconds", stage="db_write"), transaction(db_path) as conn:
+        row = conn.execute(sql + " RETURNING id", _tx_row(t)).fetchone()
+        if row and t.get("items"):
+            _replace_items(conn, row[0], t["items"])
+    return row[0] if row else None
+
+def _replace_items(conn: sqlite3.Connection, tx_id: int, items: list[dict[str, any]]):
+    conn.execute("DELETE FROM transaction_items WHERE tx_id=?", (tx_id,))
+    conn.executemany(
+        "INSERT INTO transaction_items(tx_id, pos, name, qty, unit_price, total, vat, category) VALUES (?,?,?,?,?,?,?,?)",
+        [(tx_id, pos, it["name"], it["qty"], it["unit_price"], it["total"], it.get("vat"), it.get("category"))
+         for pos, it in enumerate(items, start=1)])
+
+def insert_items(db_path: Path, tx_id: int, items: list[dict[str, any]]):
+    """Store the line items of one transaction, replacing any stored before."""
+    with transaction(db_path) as conn:
+        _replace_items(conn, tx_id, items)
+
+def list_items(db_path: Path, tx_id: int) -> list[dict[str, any]]:
+    cur = get_conn(db_path).cursor()
+    cur.row_factory = sqlite3.Row
+    cur.execute("""SELECT pos, name, qty, unit_price, total, vat, category FROM transaction_items
+                   WHERE tx_id=? ORDER BY pos""", (tx_id,))
+    return [dict(r) for r in cur.fetchall()]
+
+def existing_receipt_keys(db_path: Path, keys: list[str]) -> set[str]:
+    """Subset of `keys` already stored; one index lookup per key."""
     conn = get_conn(db_path)
-    cur = conn.cursor()
-    cur.execute(f"UPDATE transactions SET {sets} WHERE id=?", (*vals, tx_id))
-    conn.commit()
-    conn.close()
+    keys = [k for k in keys if k]
+    found: set[str] = set()
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        cur = conn.execute(
+            f"SELECT receipt_key FROM transactions WHERE receipt_key IN ({','.join('?' * len(chunk))})", chunk)
+        found.update(r[0] for r in cur.fetchall())
+    return found
+
+def insert_many_tx(db_path: Path, txs: list[dict[str, any]]) -> int:
+    """
+    Bulk insert (with line items, if present); rows whose receipt is already stored are
+    skipped. Returns rows inserted.
+    """
+    plain = [_tx_row(t) for t in txs if not t.get("items")]
+    with_items = [t for t in txs if t.get("items")]
+    if not plain and not with_items:
+        return 0
+    sql = _INSERT_TX + " ON CONFLICT DO NOTHING"
+    with metrics.timer("receipt_stage_seconds", stage="db_write_bulk"), transaction(db_path) as conn:
+        # rowcount excludes the rows written by the rollup triggers
+        n = conn.executemany(sql, plain).rowcount if plain else 0
+        for t in with_items:
+            row = conn.execute(sql + " RETURNING id", _tx_row(t)).fetchone()
+            if row:
+                _replace_items(conn, row[0], t["items"])
+                n += 1
+    return n
+
+def update_tx(db_path, tx_id, **fields):
+    bulk_update_tx(db_path, {tx_id: fields})
+
+_KEY_COLUMNS = ("raw_url", "store", "ts", "amount")   # receipt_key() arguments, in order
+
+def _update_sql(cols: tuple[str, ...]) -> tuple[str, tuple[str, ...]]:
+    """UPDATE for one set of edited columns, plus the columns whose values it binds, in order."""
+    sets = [f"{k}=?" for k in cols]
+    binds = cols
+    if set(cols) & set(_KEY_COLUMNS):
+        # SET expressions see the old row, so edited values are bound again for the key
+        args = ", ".join("?" if k in cols else k for k in _KEY_COLUMNS)
+        sets.append(f"receipt_key=receipt_key({args})")
+        binds += tuple(k for k in _KEY_COLUMNS if k in cols)
+    return f"UPDATE transactions SET {', '.join(sets)} WHERE id=?", binds
+
+def bulk_update_tx(db_path: Path, updates: dict[int, dict[str, any]]) -> int:
+    """
+    Apply {tx_id: {column: value}} in one transaction. Rows that change the same set of
+    columns share one executemany. Editing raw_url, store, ts or amount recomputes the
+    receipt key; an edit that makes a row the same receipt as another one raises
+    sqlite3.IntegrityError and nothing is saved. Returns the number of rows updated.
+    """
+    allowed = {"ts","store","amount","currency","category","kind","source","raw_url","meta_json","category_manual"}
+    groups: dict[tuple[str, ...], list[dict[str, any]]] = {}
+    for tx_id, fields in updates.items():
+        cols = tuple(sorted(k for k in fields if k in allowed))
+        if cols:
+            groups.setdefault(cols, []).append({**fields, "id": tx_id})
+    n = 0
+    with transaction(db_path) as conn:
+        for cols, rows in groups.items():
+            sql, binds = _update_sql(cols)
+            conn.executemany(sql, [(*(r[k] for k in binds), r["id"]) for r in rows])
+            n += len(rows)
+    return n
 
 def delete_tx(db_path, tx_id: int):
-    conn = get_conn(db_path)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM transactions WHERE id=?", (tx_id,))
-    conn.commit()
-    conn.close()
+    with transaction(db_path) as conn:
+        conn.execute("DELETE FROM transactions WHERE id=?", (tx_id,))
+
+def bulk_delete_tx(db_path: Path, tx_ids: list[int]) -> int:
+    ids = [(int(i),) for i in tx_ids]
+    if not ids:
+        return 0
+    with transaction(db_path) as conn:
+        conn.executemany("DELETE FROM transactions WHERE id=?", ids)
+    return len(ids)
 
 def list_tx(db_path: Path, limit=1000) -> list[dict[str, any]]:
-    conn = get_conn(db_path)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    cur = get_conn(db_path).cursor()
+    cur.row_factory = sqlite3.Row
     cur.execute(
         "SELECT id, ts, store, amount, currency, category, kind FROM transactions ORDER BY ts DESC LIMIT ?",
         (limit,))
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return rows
+    return [dict(r) for r in cur.fetchall()]
+
+def _day(d) -> date:
+    if isinstance(d, datetime):
+        return d.date()
+    if isinstance(d, date):
+        return d
+    return date.fromisoformat(str(d)[:10])
+
+def _tx_where(date_from=None, date_to=None, categories=None, kinds=None) -> tuple[str, list]:
+    """
+    WHERE clause over transactions. Dates are inclusive days compared against the ISO
+    `ts` text, so the (ts)/(category, ts)/(kind, ts) indexes apply. categories=[] matches nothing.
+    """
+    where, args = [], []
+    if date_from is not None:
+        where.append("ts >= ?"); args.append(_day(date_from).isoformat())
+    if date_to is not None:
+        where.append("ts < ?"); args.append((_day(date_to) + timedelta(days=1)).isoformat())
+    if categories is not None:
+        categories = list(categories)
+        where.append(f"category IN ({','.join('?' * len(categories))})" if categories else "0")
+        args.extend(categories)
+    if kinds is not None:
+        kinds = list(kinds)
+        where.append(f"kind IN ({','.join('?' * len(kinds))})" if kinds else "0")
+        args.extend(kinds)
+    return (" WHERE " + " AND ".join(where)) if where else "", args
+
+def query_tx(db_path: Path, date_from=None, date_to=None, categories=None, kinds=None,
+             limit: int = 1000, offset: int = 0) -> list[dict[str, any]]:
+    where, args = _tx_where(date_from, date_to, categories, kinds)
+    cur = get_conn(db_path).cursor()
+    cur.row_factory = sqlite3.Row
+    cur.execute(
+        f"""SELECT id, ts, store, amount, currency, category, kind FROM transactions{where}
+            ORDER BY ts DESC, id DESC LIMIT ? OFFSET ?""", (*args, limit, offset))
+    return [dict(r) for r in cur.fetchall()]
+
+def count_tx(db_path: Path, date_from=None, date_to=None, categories=None, kinds=None) -> int:
+    where, args = _tx_where(date_from, date_to, categories, kinds)
+    (n,) = get_conn(db_path).execute(f"SELECT COUNT(*) FROM transactions{where}", args).fetchone()
+    return n
+
+def tx_bounds(db_path: Path) -> tuple[str | None, str | None]:
+    """(earliest ts, latest ts), both None for an empty table."""
+    return get_conn(db_path).execute("SELECT MIN(ts), MAX(ts) FROM transactions").fetchone()
+
+def list_categories(db_path: Path) -> list[str]:
+    cur = get_conn(db_path).execute("SELECT DISTINCT category FROM transactions ORDER BY category")
+    return [r[0] for r in cur.fetchall()]
+
+def _rollup_where(date_from=None, date_to=None, categories=None, kinds=None) -> tuple[str, list] | None:
+    """
+    WHERE clause over monthly_rollup when the date range covers whole months
+    (or is open); None when the base table has to be scanned instead.
+    """
+    if date_from is not None and _day(date_from).day != 1:
+        return None
+    if date_to is not None and (_day(date_to) + timedelta(days=1)).day != 1:
+        return None
+    where, args = ["cnt > 0"], []
+    if date_from is not None:
+        where.append("month >= ?"); args.append(_day(date_from).isoformat()[:7])
+    if date_to is not None:
+        where.append("month <= ?"); args.append(_day(date_to).isoformat()[:7])
+    for col, values in (("category", categories), ("kind", kinds)):
+        if values is not None:
+            values = list(values)
+            where.append(f"{col} IN ({','.join('?' * len(values))})" if values else "0")
+            args.extend(values)
+    return " WHERE " + " AND ".join(where), args
+
+def totals_by_category(db_path: Path, date_from=None, date_to=None, categories=None,
+                       kind: str = "expense") -> list[dict[str, any]]:
+    rolled = _rollup_where(date_from, date_to, categories, [kind])
+    if rolled:
+        sql = "SELECT category, SUM(total) FROM monthly_rollup{} GROUP BY category ORDER BY SUM(total) DESC"
+    else:
+        rolled = _tx_where(date_from, date_to, categories, [kind])
+        sql = "SELECT category, SUM(amount) FROM transactions{} GROUP BY category ORDER BY SUM(amount) DESC"
+    cur = get_conn(db_path).execute(sql.format(rolled[0]), rolled[1])
+    return [{"category": c, "total": t} for c, t in cur.fetchall()]
+
+def totals_by_month(db_path: Path, date_from=None, date_to=None, categories=None,
+                    kind: str = "expense") -> list[dict[str, any]]:
+    rolled = _rollup_where(date_from, date_to, categories, [kind])
+    if rolled:
+        sql = "SELECT month, category, SUM(total) FROM monthly_rollup{} GROUP BY month, category ORDER BY month, category"
+    else:
+        rolled = _tx_where(date_from, date_to, categories, [kind])
+        sql = """SELECT substr(ts, 1, 7) AS month, category, SUM(amount) FROM transactions{}
+                 GROUP BY month, category ORDER BY month, category"""
+    cur = get_conn(db_path).execute(sql.format(rolled[0]), rolled[1])
+    return [{"month": m, "category": c, "total": t} for m, c, t in cur.fetchall()]
+
+def income_expense(db_path: Path, date_from=None, date_to=None, categories=None) -> dict[str, float]:
+    rolled = _rollup_where(date_from, date_to, categories)
+    if rolled:
+        sql = """SELECT
+                   COALESCE(SUM(CASE WHEN kind='income' THEN total END),0),
+                   COALESCE(SUM(CASE WHEN kind='expense' THEN total END),0)
+                 FROM monthly_rollup{}"""
+    else:
+        rolled = _tx_where(date_from, date_to, categories)
+        sql = """SELECT
+                   COALESCE(SUM(CASE WHEN kind='income' THEN amount END),0),
+                   COALESCE(SUM(CASE WHEN kind='expense' THEN amount END),0)
+                 FROM transactions{}"""
+    inc, exp = get_conn(db_path).execute(sql.format(rolled[0]), rolled[1]).fetchone()
+    return {"income": float(inc), "expense": float(exp)}
 
 def get_all_rules(db_path: Path):
-    conn = get_conn(db_path); conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    cur = get_conn(db_path).cursor(); cur.row_factory = sqlite3.Row
     cur.execute("SELECT id, pattern, category, enabled, priority FROM rules ORDER BY priority ASC, id ASC")
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return rows
+    return [dict(r) for r in cur.fetchall()]
 
 def add_rule(db_path: Path, pattern: str, category: str, enabled: int = 1, priority: int = 100):
-    conn = get_conn(db_path); cur = conn.cursor()
-    cur.execute("INSERT INTO rules(pattern, category, enabled, priority) VALUES (?,?,?,?)",
-                (pattern, category, enabled, priority))
-    conn.commit(); conn.close()
+    with transaction(db_path) as conn:
+        conn.execute("INSERT INTO rules(pattern, category, enabled, priority) VALUES (?,?,?,?)",
+                     (pattern, category, enabled, priority))
 
 def update_rule(db_path: Path, rule_id: int, pattern: str, category: str, enabled: int, priority: int):
-    conn = get_conn(db_path); cur = conn.cursor()
-    cur.execute("""UPDATE rules SET pattern=?, category=?, enabled=?, priority=? WHERE id=?""",
-                (pattern, category, enabled, priority, rule_id))
-    conn.commit(); conn.close()
+    with transaction(db_path) as conn:
+        conn.execute("""UPDATE rules SET pattern=?, category=?, enabled=?, priority=? WHERE id=?""",
+                     (pattern, category, enabled, priority, rule_id))
 
 def delete_rule(db_path: Path, rule_id: int):
-    conn = get_conn(db_path); cur = conn.cursor()
-    cur.execute("DELETE FROM rules WHERE id=?", (rule_id,))
-    conn.commit(); conn.close()
+    with transaction(db_path) as conn:
+        conn.execute("DELETE FROM rules WHERE id=?", (rule_id,))
 
 def current_balance(db_path: Path) -> int:
+    # maintained by the trg_tx_rollup_* triggers, see _m003_rollups
+    row = get_conn(db_path).execute("SELECT income - expense FROM balance_rollup WHERE id=1").fetchone()
+    return round(float(row[0]), 2) if row else 0.0
+
+def _rebuild_rollups(cur):
+    cur.execute("DELETE FROM monthly_rollup")
+    cur.execute("""INSERT INTO monthly_rollup(month, category, kind, total, cnt)
+                   SELECT substr(ts, 1, 7), category, kind, SUM(amount), COUNT(*)
+                   FROM transactions GROUP BY 1, 2, 3""")
+    cur.execute("DELETE FROM balance_rollup")
+    cur.execute("""INSERT INTO balance_rollup(id, income, expense, cnt)
+                   SELECT 1,
+                     COALESCE(SUM(CASE WHEN kind='income' THEN amount END),0),
+                     COALESCE(SUM(CASE WHEN kind='expense' THEN amount END),0),
+                     COUNT(*)
+                   FROM transactions""")
+
+def rebuild_rollups(db_path: Path):
+    """Recompute monthly_rollup and balance_rollup from the transactions table."""
+    with transaction(db_path) as conn:
+        _rebuild_rollups(conn.cursor())
+
+def verify_rollups(db_path: Path, tolerance: float = 0.005) -> list[dict[str, any]]:
+    """Differences between the rollup tables and the base table; an empty list means in sync."""
     conn = get_conn(db_path)
-    cur = conn.cursor()
-    cur.execute("""SELECT
-        COALESCE(SUM(CASE WHEN kind='income' THEN amount END),0) -
-        COALESCE(SUM(CASE WHEN kind='expense' THEN amount END),0)
-      FROM transactions""")
-    (bal,) = cur.fetchone()
-    conn.close()
-    return float(bal)
+    expected = {(m, c, k): (t, n) for m, c, k, t, n in conn.execute(
+        "SELECT substr(ts, 1, 7), category, kind, SUM(amount), COUNT(*) FROM transactions GROUP BY 1, 2, 3")}
+    actual = {(m, c, k): (t, n) for m, c, k, t, n in conn.execute(
+        "SELECT month, category, kind, total, cnt FROM monthly_rollup")}
+    problems = []
+    for key in expected.keys() | actual.keys():
+        exp_t, exp_n = expected.get(key, (0.0, 0))
+        act_t, act_n = actual.get(key, (0.0, 0))
+        if exp_n != act_n or abs(exp_t - act_t) > tolerance:
+            problems.append({"month": key[0], "category": key[1], "kind": key[2],
+                             "expected": exp_t, "actual": act_t, "expected_rows": exp_n, "actual_rows": act_n})
+    inc, exp, n = conn.execute("""SELECT
+        COALESCE(SUM(CASE WHEN kind='income' THEN amount END),0),
+        COALESCE(SUM(CASE WHEN kind='expense' THEN amount END),0), COUNT(*) FROM transactions""").fetchone()
+    row = conn.execute("SELECT income, expense, cnt FROM balance_rollup WHERE id=1").fetchone() or (0.0, 0.0, 0)
+    if row[2] != n or abs(row[0] - inc) > tolerance or abs(row[1] - exp) > tolerance:
+        problems.append({"balance": True, "expected": (inc, exp, n), "actual": tuple(row)})
+    return problems
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+def add_job(db_path: Path, kind: str, payload: bytes) -> str:
+    job_id = uuid.uuid4().hex
+    now = datetime.now().isoformat()
+    with transaction(aux_db_path(db_path)) as conn:
+        conn.execute("INSERT INTO jobs(id, kind, payload, status, created_at, updated_at) VALUES (?,?,?,?,?,?)",
+                     (job_id, kind, payload, "queued", now, now))
+    return job_id
+
+def set_job_status(db_path: Path, job_id: str, status: str, result: dict | None = None, error: str | None = None):
+    with transaction(aux_db_path(db_path)) as conn:
+        conn.execute("UPDATE jobs SET status=?, result_json=?, error=?, updated_at=? WHERE id=?",
+                     (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                      datetime.now().isoformat(), job_id))
+
+def get_job(db_path: Path, job_id: str) -> dict[str, any] | None:
+    cur = get_conn(aux_db_path(db_path)).cursor()
+    cur.row_factory = sqlite3.Row
+    cur.execute("SELECT id, kind, status, result_json, error, created_at, updated_at FROM jobs WHERE id=?", (job_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    raw = job.pop("result_json")
+    job["result"] = json.loads(raw) if raw else None
+    return job
+
+
+def pending_jobs(db_path: Path) -> list[tuple[str, str, bytes]]:
+    """(id, kind, payload) of jobs not finished yet - including ones interrupted while running."""
+    cur = get_conn(aux_db_path(db_path)).execute(
+        "SELECT id, kind, payload FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at")
+    return cur.fetchall()
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+_cache_counters = {"hits": 0, "misses": 0}
+
+def cache_get_receipt(db_path: Path, url_key: str) -> dict[str, any] | None:
+    """
+    Cached receipt page for a normalized URL: {"html", "data", "parser_version"}, or None.
+    """
+    cur = get_conn(aux_db_path(db_path)).cursor()
+    cur.execute("SELECT html_z, data_json, parser_version FROM receipt_cache WHERE url_key=?", (url_key,))
+    row = cur.fetchone()
+    if row is None:
+        _cache_counters["misses"] += 1
+        return None
+    _cache_counters["hits"] += 1
+    with transaction(aux_db_path(db_path)) as conn:
+        conn.execute("UPDATE receipt_cache SET hits=hits+1, accessed_at=? WHERE url_key=?",
+                     (datetime.now().isoformat(), url_key))
+    html_z, data_json, version = row
+    return {"html": zlib.decompress(html_z).decode("utf-8"), "data": json.loads(data_json), "parser_version": version}
+
+def cache_put_receipt(db_path: Path, url_key: str, html: str, data: dict, parser_version: int,
+                      max_bytes: int = CACHE_MAX_BYTES):
+    html_z = zlib.compress(html.encode("utf-8"), 6)
+    data_json = json.dumps(data, ensure_ascii=False)
+    now = datetime.now().isoformat()
+    with transaction(aux_db_path(db_path)) as conn:
+        conn.execute(
+            """INSERT INTO receipt_cache(url_key, html_z, data_json, parser_version, size, fetched_at, accessed_at)
+               VALUES (?,?,?,?,?,?,?)
+               ON CONFLICT(url_key) DO UPDATE SET html_z=excluded.html_z, data_json=excluded.data_json,
+                 parser_version=excluded.parser_version, size=excluded.size, accessed_at=excluded.accessed_at""",
+            (url_key, html_z, data_json, parser_version, len(html_z) + len(data_json), now, now))
+        # size-based eviction: drop least recently used entries beyond the budget
+        conn.execute(
+            """DELETE FROM receipt_cache WHERE url_key IN (
+                 SELECT url_key FROM (
+                   SELECT url_key, SUM(size) OVER (ORDER BY accessed_at DESC, url_key) AS running
+                   FROM receipt_cache)
+                 WHERE running > ?)""", (max_bytes,))
+
+def cache_stats(db_path: Path) -> dict[str, int]:
+    cur = get_conn(aux_db_path(db_path)).cursor()
+    cur.execute("SELECT COUNT(*), COALESCE(SUM(size),0), COALESCE(SUM(hits),0) FROM receipt_cache")
+    entries, size, stored_hits = cur.fetchone()
+    return {"entries": entries, "bytes": size, "stored_hits": stored_hits, **_cache_counters}
+
+def duplicate_urls(db_path: Path) -> list[dict[str, any]]:
+    """Transactions whose receipt URL duplicated an earlier row's when migration 2 ran."""
+    cur = get_conn(db_path).cursor()
+    cur.row_factory = sqlite3.Row
+    cur.execute("""SELECT d.tx_id, d.raw_url, d.kept_tx_id, t.ts, t.store, t.amount
+                   FROM duplicate_raw_urls d LEFT JOIN transactions t ON t.id = d.tx_id ORDER BY d.tx_id""")
+    return [dict(r) for r in cur.fetchall()]
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Database maintenance")
+    ap.add_argument("command", choices=["migrate", "verify-rollups", "rebuild-rollups", "duplicates"])
+    add_db_args(ap)
+    args = ap.parse_args(argv)
+    args.db = resolve_db(args.db, args.user)
+
+    version = migrate(args.db)
+    if args.command == "migrate":
+        print(f"schema version {version}")
+    elif args.command == "duplicates":
+        dups = duplicate_urls(args.db)
+        for d in dups:
+            print(f"tx {d['tx_id']} ({d['ts']}, {d['store']}, {d['amount']}) repeats tx {d['kept_tx_id']}: {d['raw_url']}")
+        print(f"{len(dups)} duplicate receipt URL(s)")
+    elif args.command == "rebuild-rollups":
+        rebuild_rollups(args.db)
+        print("rollups rebuilt")
+    else:
+        problems = verify_rollups(args.db)
+        for p in problems:
+            print(p)
+        print("rollups OK" if not problems else f"{len(problems)} mismatch(es), run rebuild-rollups")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
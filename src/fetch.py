@@ -0,0 +1,138 @@
+# src/fetch.py
+"""
+Shared HTTP client for the SUF verification portal: one pooled keep-alive session,
+separate connect/read timeouts, retries with exponential backoff + jitter on 5xx and
+timeouts, a per-host cap on concurrent requests and an overall deadline per fetch.
+"""
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+from src import metrics
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+MAX_RETRIES = 3
+READ_RETRIES = 1     # each read timeout already cost READ_TIMEOUT seconds
+DEADLINE = 20        # seconds per fetch_html call, all attempts and backoff included
+BACKOFF_FACTOR = 0.5
+BACKOFF_JITTER = 0.3
+POOL_SIZE = 16
+PER_HOST_LIMIT = 4
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/127.0 Safari/537.36",
+    "Accept-Language": "sr-RS,sr;q=0.9,en;q=0.8",
+}
+
+_lock = threading.Lock()
+_session: requests.Session | None = None
+_host_slots: dict[str, threading.BoundedSemaphore] = {}
+_budget = threading.local()   # (deadline, read timeout) of the fetch running on this thread
+
+
+class _DeadlineRetry(Retry):
+    """
+    Retry that also gives up when the next attempt - the wait before it plus a full read
+    timeout - could not finish before the deadline of the current fetch_html call.
+    """
+
+    def _wait(self, response) -> float:
+        # what `sleep` will wait: the server's Retry-After when it sent one, else backoff
+        if self.respect_retry_after_header and response is not None:
+            retry_after = self.get_retry_after(response)
+            if retry_after:
+                return retry_after
+        return self.get_backoff_time()
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        new = super().increment(method, url, response, error, _pool, _stacktrace)
+        deadline, read_timeout = getattr(_budget, "limits", (None, 0))
+        if deadline is not None and time.monotonic() + new._wait(response) + read_timeout > deadline:
+            metrics.inc("fetch_deadline_exceeded_total")
+            raise MaxRetryError(_pool, url, error or "fetch deadline exceeded")
+        return new
+
+
+def _build_session() -> requests.Session:
+    retry = _DeadlineRetry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=READ_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        backoff_jitter=BACKOFF_JITTER,
+        status_forcelist=(500, 502, 503, 504),
+        # read timeouts and 5xx are retried for idempotent methods only: a POST the
+        # server may already have acted on is never sent twice
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    s = requests.Session()
+    s.headers.update(HEADERS)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def reset_session():
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _host_slots.clear()
+
+
+def _slot(host: str) -> threading.BoundedSemaphore:
+    sem = _host_slots.get(host)
+    if sem is None:
+        with _lock:
+            sem = _host_slots.setdefault(host, threading.BoundedSemaphore(PER_HOST_LIMIT))
+    return sem
+
+
+def fetch_html(url: str, timeout: tuple[float, float] | None = None,
+               deadline: float | None = DEADLINE) -> str | None:
+    """
+    GET `url` through the shared session. Returns the page text, or None on a non-2xx
+    answer. Network errors that survive the retries are raised to the caller. No retry
+    is started that could run past `deadline` seconds (counted from the call, waiting
+    for a per-host slot included).
+    """
+    host = urlparse(url).netloc
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    limits = (time.monotonic() + deadline if deadline else None, timeout[1] or 0)
+    with metrics.timer("receipt_stage_seconds", stage="fetch"), _slot(host):
+        _budget.limits = limits
+        try:
+            r = get_session().get(url, timeout=timeout)
+        except requests.RequestException as e:
+            metrics.inc("fetch_errors_total", error=type(e).__name__)
+            raise
+        finally:
+            _budget.limits = (None, 0)
+    retries = getattr(r.raw, "retries", None)
+    if retries is not None and retries.history:
+        metrics.inc("fetch_retries_total", len(retries.history))
+    metrics.inc("fetch_responses_total", status=r.status_code)
+    r.encoding = "utf-8"
+    if r.ok and r.text:
+        return r.text
+    return None
@@ -0,0 +1,46 @@
+# src/identity.py
+"""
+Receipt identity: one canonical key per fiscal receipt, used to keep the same receipt
+from being stored twice (unique index on transactions.receipt_key).
+"""
+import hashlib
+from urllib.parse import unquote, urlparse, urlunparse
+
+# query parameters that carry the signed SUF verification payload
+_SUF_PARAMS = ("vl",)
+
+
+def normalize_receipt_url(url: str) -> str:
+    """
+    Canonical form of a receipt URL: lower-cased scheme/host, no fragment, no default port,
+    query parameters in a stable order (values are kept raw, SUF `vl` is base64).
+    """
+    u = urlparse(url.strip())
+    scheme = u.scheme.lower()
+    host = (u.hostname or "").lower()
+    if u.port and not ((scheme == "http" and u.port == 80) or (scheme == "https" and u.port == 443)):
+        host = f"{host}:{u.port}"
+    query = "&".join(sorted(p for p in u.query.split("&") if p))
+    return urlunparse((scheme, host, u.path or "/", "", query, ""))
+
+
+def receipt_key(url: str | None = None, store: str | None = None, ts: str | None = None,
+                amount: float | None = None) -> str | None:
+    """
+    "suf:<payload>" for SUF verification URLs (host independent), "url:<normalized url>"
+    for other URLs, "h:<hash of store, time, amount>" for manual entries; None when there
+    is not enough to identify the receipt.
+    """
+    if url and url.strip():
+        u = urlparse(url.strip())
+        for pair in u.query.split("&"):
+            name, _, value = pair.partition("=")
+            if name in _SUF_PARAMS and value:
+                # unquote, not unquote_plus: '+' is part of the base64 payload
+                return "suf:" + unquote(value)
+        return "url:" + normalize_receipt_url(url)
+    if store and ts and amount is not None:
+        from src.categorize import normalize_store
+        raw = f"{normalize_store(store).casefold()}|{str(ts)[:19]}|{float(amount):.2f}"
+        return "h:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return None
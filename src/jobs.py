@@ -0,0 +1,51 @@
+# src/jobs.py
+"""
+In-process background jobs for the UI. Work runs on a small shared thread pool and is
+keyed (receipt URL, upload id), so a Streamlit rerun picks up the running future
+instead of starting the same fetch again, and a finished result is served from memory.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+WORKERS = 4
+MAX_RESULTS = 256    # finished futures kept for reuse, oldest dropped first
+
+_pool: ThreadPoolExecutor | None = None
+_lock = threading.Lock()
+_futures: "OrderedDict[str, Future]" = OrderedDict()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="ui-job")
+    return _pool
+
+
+def submit(key: str, fn, *args, **kwargs) -> Future:
+    """Future for `key`; `fn(*args, **kwargs)` is started only if no job with this key is known."""
+    with _lock:
+        fut = _futures.get(key)
+        if fut is not None:
+            _futures.move_to_end(key)
+            return fut
+        fut = _futures[key] = _get_pool().submit(fn, *args, **kwargs)
+        if len(_futures) > MAX_RESULTS:
+            for k in [k for k, f in _futures.items() if f.done()][:len(_futures) - MAX_RESULTS]:
+                del _futures[k]
+        return fut
+
+
+def forget(key: str):
+    """Drop a finished job so the next submit runs it again (e.g. retry after a failure)."""
+    with _lock:
+        fut = _futures.get(key)
+        if fut is not None and fut.done():
+            del _futures[key]
+
+
+def status(fut: Future) -> str:
+    if not fut.done():
+        return "running"
+    return "failed" if fut.exception() is not None else "done"
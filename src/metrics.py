@@ -0,0 +1,164 @@
+# src/metrics.py
+"""
+Process-wide counters and latency histograms for the receipt pipeline, exposed as
+Prometheus text (`render`, `serve`) and as a plain snapshot for the app's debug panel.
+
+Off unless RECEIPTS_METRICS=1 (or `enable()` is called): then `inc` returns at once and
+`timer` hands out one shared no-op context manager, so instrumented code pays a
+function call per stage and nothing else.
+
+    with metrics.timer("receipt_stage_seconds", stage="fetch"):
+        html = fetch_html(url)
+    metrics.inc("receipt_cache_total", result="hit")
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+ENABLED = os.environ.get("RECEIPTS_METRICS", "").lower() in ("1", "true", "yes", "on")
+PORT = int(os.environ.get("RECEIPTS_METRICS_PORT", 9464))
+# seconds; spans a cached regex match up to a portal fetch that hits the read timeout
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, tuple], float] = {}
+_histograms: dict[tuple[str, tuple], list] = {}   # key -> [bucket counts..., sum, count]
+_NULL = nullcontext()
+_server = None
+
+
+def enable(on: bool = True):
+    global ENABLED
+    ENABLED = on
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        h[bisect_left(BUCKETS, seconds)] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "t0")
+
+    def __init__(self, name: str, labels: dict):
+        self.name, self.labels = name, labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.t0, **self.labels)
+        return False
+
+
+def timer(name: str, **labels):
+    """Context manager recording the block's wall time into histogram `name`."""
+    return _Timer(name, labels) if ENABLED else _NULL
+
+
+def _fmt_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+def render() -> str:
+    """Everything recorded so far in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+    lines: list[str] = []
+    typed: set[str] = set()
+    for (name, labels), v in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {v:g}")
+    for (name, labels), h in histograms:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for le, n in zip((*BUCKETS, "+Inf"), h[:-2]):
+            cumulative += n
+            lines.append(f"{name}_bucket{_fmt_labels((*labels, ('le', le)))} {cumulative}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-2]:.6f}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict[str, list[dict]]:
+    """{"counters": [...], "histograms": [...]} as flat rows, for tables in the UI."""
+    with _lock:
+        counters = [{"name": n, **dict(l), "value": v} for (n, l), v in sorted(_counters.items())]
+        histograms = []
+        for (n, l), h in sorted(_histograms.items()):
+            total, count = h[-2], h[-1]
+            histograms.append({"name": n, **dict(l), "count": count,
+                               "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+                               "p50_le_ms": _quantile_bound(h, 0.5), "p95_le_ms": _quantile_bound(h, 0.95)})
+    return {"counters": counters, "histograms": histograms}
+
+
+def _quantile_bound(h: list, q: float) -> float | None:
+    """Upper bucket bound (ms) holding the q-quantile; None when it lies past the last bucket."""
+    target, seen = q * h[-1], 0
+    for le, n in zip(BUCKETS, h[:-3]):
+        seen += n
+        if seen >= target and seen:
+            return le * 1000
+    return None
+
+
+def serve(port: int | None = None, host: str = "127.0.0.1") -> int:
+    """Start the /metrics endpoint on a daemon thread (once per process); returns the port."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer   # only when serving
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, PORT if port is None else port), Handler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server.server_address[1]
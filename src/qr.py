@@ -0,0 +1,279 @@
+# src/qr.py
+"""
+QR decoding engine. A ladder of cheap pre-processing strategies (downscale, grayscale,
+adaptive threshold, rotations) runs concurrently on a shared thread pool, the
+full-resolution ones (full image, detected crop, quadrants) on a second, smaller shared
+pool; the first strategy that yields a QR payload wins and the rest are cancelled. pyzbar and OpenCV both release the GIL, so the strategies really overlap.
+"""
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+from src import metrics
+
+MAX_SIDE = 1600      # working resolution for the cheap strategies
+# pixel budget for a decoded upload (~12 MB as 8-bit gray); override with QR_MAX_PIXELS
+MAX_PIXELS = int(os.environ.get("QR_MAX_PIXELS", 12_000_000))
+WORKERS = 4
+# for the strategies in EXPENSIVE, across all decode_qr calls: caps the full-resolution
+# decodes (and the page arrays they hold) still running after their call returned
+EXPENSIVE_WORKERS = 2
+CROP_MARGIN = 0.15
+
+_pool: ThreadPoolExecutor | None = None
+_full_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="qr")
+    return _pool
+
+
+def _get_full_pool() -> ThreadPoolExecutor:
+    global _full_pool
+    if _full_pool is None:
+        with _pool_lock:
+            if _full_pool is None:
+                _full_pool = ThreadPoolExecutor(max_workers=EXPENSIVE_WORKERS, thread_name_prefix="qr-full")
+    return _full_pool
+
+
+def _decode_pyzbar(arr: np.ndarray) -> str | None:
+    try:
+        from pyzbar.pyzbar import ZBarSymbol, decode
+        for c in decode(arr, symbols=[ZBarSymbol.QRCODE]):
+            return c.data.decode("utf-8", errors="ignore")
+    except Exception as e:
+        metrics.inc("qr_decoder_errors_total", decoder="pyzbar", error=type(e).__name__)
+        return None
+    return None
+
+
+def _decode_opencv(arr: np.ndarray) -> str | None:
+    try:
+        data, _, _ = cv2.QRCodeDetector().detectAndDecode(arr)
+        return data or None
+    except Exception as e:
+        metrics.inc("qr_decoder_errors_total", decoder="opencv", error=type(e).__name__)
+        return None
+
+
+def _downscale(gray: np.ndarray, max_side: int = MAX_SIDE) -> np.ndarray:
+    h, w = gray.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def _threshold(small: np.ndarray) -> np.ndarray:
+    return cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+
+
+def _detected_crop(gray: np.ndarray, small: np.ndarray) -> np.ndarray | None:
+    """Region around the QR finder pattern located on the small image, cut from full resolution."""
+    ok, pts = cv2.QRCodeDetector().detect(small)
+    if not ok or pts is None:
+        return None
+    scale = gray.shape[1] / small.shape[1]
+    pts = pts.reshape(-1, 2) * scale
+    x0, y0 = pts.min(axis=0)
+    x1, y1 = pts.max(axis=0)
+    mx, my = (x1 - x0) * CROP_MARGIN, (y1 - y0) * CROP_MARGIN
+    h, w = gray.shape
+    x0, y0 = max(0, int(x0 - mx)), max(0, int(y0 - my))
+    x1, y1 = min(w, int(x1 + mx)), min(h, int(y1 + my))
+    if x1 - x0 < 20 or y1 - y0 < 20:
+        return None
+    return _downscale(gray[y0:y1, x0:x1])
+
+
+def _quadrant(gray: np.ndarray, qx: int, qy: int) -> np.ndarray:
+    """One of four overlapping crops (60% of each side) for small codes in big photos."""
+    h, w = gray.shape
+    ch, cw = int(h * 0.6), int(w * 0.6)
+    y0, x0 = qy * (h - ch), qx * (w - cw)
+    return _downscale(gray[y0:y0 + ch, x0:x0 + cw])
+
+
+# (name, fn(gray, small) -> image to decode or None), roughly cheapest first
+STRATEGIES = [
+    ("downscale", lambda gray, small: small),
+    ("threshold", lambda gray, small: _threshold(small)),
+    ("full", lambda gray, small: gray),
+    ("rot90", lambda gray, small: cv2.rotate(small, cv2.ROTATE_90_CLOCKWISE)),
+    ("rot180", lambda gray, small: cv2.rotate(small, cv2.ROTATE_180)),
+    ("rot270", lambda gray, small: cv2.rotate(small, cv2.ROTATE_90_COUNTERCLOCKWISE)),
+    ("detected_crop", _detected_crop),
+    ("quadrant_tl", lambda gray, small: _quadrant(gray, 0, 0)),
+    ("quadrant_tr", lambda gray, small: _quadrant(gray, 1, 0)),
+    ("quadrant_bl", lambda gray, small: _quadrant(gray, 0, 1)),
+    ("quadrant_br", lambda gray, small: _quadrant(gray, 1, 1)),
+]
+# work on the full-resolution image: kept off the cheap pool, so a call that already
+# has its answer never leaves them occupying workers other uploads are waiting for
+EXPENSIVE = {"full", "detected_crop", "quadrant_tl", "quadrant_tr", "quadrant_bl", "quadrant_br"}
+
+
+def _run(name, fn, gray, small, stop: threading.Event) -> tuple[str, str | None, float]:
+    t0 = time.perf_counter()
+    if stop.is_set():
+        return name, None, 0.0
+    img = fn(gray, small)
+    data = None
+    # a decode can't be interrupted, but the next step is skipped once another strategy won
+    if img is not None and not stop.is_set():
+        data = _decode_pyzbar(img)
+        if data is None and not stop.is_set():
+            data = _decode_opencv(img)
+    return name, data, (time.perf_counter() - t0) * 1000
+
+
+def load_gray(file, max_pixels: int | None = None) -> np.ndarray:
+    """
+    Decode an uploaded image straight to an 8-bit grayscale array of at most
+    `max_pixels` pixels. JPEGs are scaled and converted inside the decoder (draft
+    mode), so a 48 MP photo never exists at full size in memory; other formats are
+    reduced right after decoding.
+    """
+    budget = max_pixels or MAX_PIXELS
+    img = Image.open(file)
+    w, h = img.size
+    if img.format == "JPEG":
+        scale = min(1.0, math.sqrt(budget / (w * h)))
+        img.draft("L", (max(1, int(w * scale)), max(1, int(h * scale))))
+    return _budgeted_gray(img, budget)
+
+
+def _budgeted_gray(img: Image.Image, budget: int) -> np.ndarray:
+    # gray first: reduce() rejects "1", "P" and "I;16" (bilevel scans, palette GIFs, 16-bit TIFFs)
+    if img.mode != "L":
+        img = img.convert("L")
+    if img.width * img.height > budget:
+        img = img.reduce(math.ceil(math.sqrt(img.width * img.height / budget)))
+    return np.asarray(img)
+
+
+PDF_DPI = 200
+
+
+def iter_pages(file, max_pixels: int | None = None):
+    """
+    Yield one grayscale array per page of a PDF (rendered with pypdfium2, page by page)
+    or of a multi-frame image such as a scanner TIFF; a plain photo yields one page.
+    """
+    budget = max_pixels or MAX_PIXELS
+    head = file.read(5)
+    file.seek(0)
+    if head == b"%PDF-":
+        try:
+            import pypdfium2 as pdfium
+        except ImportError as e:
+            raise RuntimeError("PDF scanning requires pypdfium2: pip install pypdfium2") from e
+        pdf = pdfium.PdfDocument(file)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                w, h = page.get_size()   # points, 1/72 inch
+                scale = min(PDF_DPI / 72, math.sqrt(budget / (w * h)))
+                bitmap = page.render(scale=scale, grayscale=True)
+                yield _budgeted_gray(bitmap.to_pil(), budget)
+                bitmap.close()
+                page.close()
+        finally:
+            pdf.close()
+        return
+
+    img = Image.open(file)
+    if getattr(img, "n_frames", 1) == 1:
+        file.seek(0)
+        yield load_gray(file, budget)
+        return
+    for frame in ImageSequence.Iterator(img):
+        yield _budgeted_gray(frame, budget)
+
+
+def decode_all(image) -> list[str]:
+    """
+    Every QR payload on one page, in detection order, without duplicates. Falls back
+    to the single-code strategy ladder when the direct multi-code pass finds nothing.
+    """
+    gray = to_gray(image)
+    found: list[str] = []
+    try:
+        from pyzbar.pyzbar import ZBarSymbol, decode
+        found += [c.data.decode("utf-8", errors="ignore") for c in decode(gray, symbols=[ZBarSymbol.QRCODE])]
+    except Exception as e:
+        metrics.inc("qr_decoder_errors_total", decoder="pyzbar_multi", error=type(e).__name__)
+    try:
+        ok, infos, _, _ = cv2.QRCodeDetector().detectAndDecodeMulti(gray)
+        if ok:
+            found += [d for d in infos if d]
+    except Exception as e:
+        metrics.inc("qr_decoder_errors_total", decoder="opencv_multi", error=type(e).__name__)
+    if not found:
+        single = decode_qr(gray)["data"]
+        found = [single] if single else []
+    return list(dict.fromkeys(d for d in found if d))
+
+
+def to_gray(image) -> np.ndarray:
+    """
+    uint8 grayscale array from a PIL image or an RGB/gray numpy array. A contiguous gray
+    array is returned as is, so pyzbar and OpenCV share one buffer.
+    """
+    arr = np.asarray(image)
+    if arr.ndim == 3:
+        arr = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+    return np.ascontiguousarray(arr, dtype=np.uint8)
+
+
+def decode_qr(image, strategies=None, timeout: float | None = None) -> dict[str, any]:
+    """
+    Decode a QR code from a PIL image or numpy array.
+    Returns {"data": str | None, "strategy": name | None, "timings": {name: ms}, "elapsed_ms": float}.
+    """
+    started = time.perf_counter()
+    gray = to_gray(image)
+    small = _downscale(gray)
+    stop = threading.Event()
+    strategies = strategies or STRATEGIES
+    pending = {(_get_full_pool() if name in EXPENSIVE else _get_pool())
+               .submit(_run, name, fn, gray, small, stop) for name, fn in strategies}
+    result = {"data": None, "strategy": None, "timings": {}}
+    deadline = started + timeout if timeout else None
+    while pending:
+        left = None if deadline is None else max(0.0, deadline - time.perf_counter())
+        done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for fut in done:
+            try:
+                name, data, ms = fut.result()
+            except Exception as e:
+                metrics.inc("qr_decoder_errors_total", decoder="strategy", error=type(e).__name__)
+                continue
+            result["timings"][name] = round(ms, 2)
+            if data and result["data"] is None:
+                result["data"], result["strategy"] = data, name
+        if result["data"] is not None:
+            break
+    stop.set()
+    for fut in pending:
+        fut.cancel()
+    elapsed = time.perf_counter() - started
+    result["elapsed_ms"] = round(elapsed * 1000, 2)
+    metrics.observe("receipt_stage_seconds", elapsed, stage="qr_decode")
+    metrics.inc("qr_strategy_total", strategy=result["strategy"] or "none")
+    return result
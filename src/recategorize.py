@@ -0,0 +1,95 @@
+# src/recategorize.py
+import argparse
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from src.categorize import normalize_store, rule_engine
+from src.db import add_db_args, get_conn, resolve_db, transaction
+
+CHUNK_SIZE = 50_000
+
+
+def recategorize(db_path: Path, apply: bool = False, skip_manual: bool = True, keep_unmatched: bool = True,
+                 chunk_size: int = CHUNK_SIZE, preview_limit: int = 500) -> dict[str, any]:
+    """
+    Re-run the current rules over every stored transaction.
+
+    Rows are streamed in chunks and every distinct normalized store is matched once.
+    With apply=False nothing is written (dry run); the result always contains the
+    diff preview, change counts per (old, new) category pair and throughput.
+    keep_unmatched leaves rows alone when no rule matches instead of resetting them to 'other'.
+    """
+    started = time.perf_counter()
+    engine = rule_engine(db_path)
+    memo: dict[str, str | None] = {}
+    changes: list[tuple[str, int]] = []
+    preview: list[dict[str, any]] = []
+    by_change: Counter = Counter()
+    scanned = skipped_manual = 0
+
+    cur = get_conn(db_path).cursor()
+    cur.execute("SELECT id, store, category, category_manual FROM transactions ORDER BY id")
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        scanned += len(rows)
+        for tx_id, store, old, manual in rows:
+            if skip_manual and manual:
+                skipped_manual += 1
+                continue
+            if store in memo:
+                new = memo[store]
+            else:
+                s = normalize_store(store)
+                new = memo[store] = (engine.match(s) if s else None)
+            if new is None:
+                if keep_unmatched:
+                    continue
+                new = "other"
+            if new != old:
+                changes.append((new, tx_id))
+                by_change[(old, new)] += 1
+                if len(preview) < preview_limit:
+                    preview.append({"id": tx_id, "store": store, "old": old, "new": new})
+
+    if apply and changes:
+        with transaction(db_path) as conn:
+            conn.executemany("UPDATE transactions SET category=? WHERE id=?", changes)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "applied": bool(apply),
+        "scanned": scanned,
+        "changed": len(changes),
+        "skipped_manual": skipped_manual,
+        "distinct_stores": len(memo),
+        "elapsed": elapsed,
+        "rows_per_sec": scanned / elapsed if elapsed > 0 else 0.0,
+        "by_change": [{"old": o, "new": n, "rows": c} for (o, n), c in by_change.most_common()],
+        "preview": preview,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Re-categorize stored transactions with the current rules")
+    add_db_args(ap)
+    ap.add_argument("--apply", action="store_true", help="write changes (default: dry run)")
+    ap.add_argument("--include-manual", action="store_true", help="also touch rows whose category was set by hand")
+    ap.add_argument("--reset-unmatched", action="store_true", help="set rows no rule matches to 'other'")
+    args = ap.parse_args(argv)
+
+    res = recategorize(resolve_db(args.db, args.user), apply=args.apply, skip_manual=not args.include_manual,
+                       keep_unmatched=not args.reset_unmatched)
+    for c in res["by_change"]:
+        print(f"{c['old']!r:>24} -> {c['new']!r:<24} {c['rows']}")
+    verb = "changed" if res["applied"] else "would change"
+    print(f"{res['scanned']} rows scanned, {verb} {res['changed']}, skipped manual {res['skipped_manual']} "
+          f"({res['rows_per_sec']:.0f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,21 @@
 # src/receipt.py
 from urllib.parse import urlparse, parse_qs
 import re
-import requests
-from PIL import Image
+from functools import lru_cache
+from html import unescape
+from typing import TYPE_CHECKING, Callable
 from datetime import datetime
-from bs4 import BeautifulSoup
+
+from src import metrics
+from src.identity import normalize_receipt_url
+
+# bs4, requests (src.fetch) and OpenCV/numpy/PIL (src.qr) are imported where they are
+# first needed, so importing this module for URL parsing stays cheap; see bench/suite.py
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# bump when _extract_html output changes so cached pages get re-parsed
+PARSER_VERSION = 3
 
 def _from_string_to_iso(dt_str: str) -> str:
     dateformat = "%d.%m.%Y. %H:%M:%S"
@@ -12,34 +23,35 @@ def _from_string_to_iso(dt_str: str) -> str:
         dt = datetime.strptime(dt_str, dateformat)
         return dt.isoformat()
     except Exception:
+        metrics.inc("receipt_parse_errors_total", field="ts")
         return ''
 
-def _decode_qr_pyzbar(image) -> str | None:
-    try:
-        from pyzbar.pyzbar import decode
-        codes = decode(image)
-        for c in codes:
-            if c.type == "QRCODE":
-                return c.data.decode("utf-8", errors="ignore")
-    except Exception:
-        return None
-    return None
-
-def _decode_qr_opencv(image) -> str | None:
-    try:
-        import cv2
-        import numpy as np
-        cv_img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        det = cv2.QRCodeDetector()
-        data, pts, _ = det.detectAndDecode(cv_img)
-        return data or None
-    except Exception:
-        return None
+def parse_from_qr_image(file, max_pixels: int | None = None) -> dict[str, any]:
+    """
+    {"url": payload, "qr": {"strategy", "timings", "elapsed_ms"}} or {} when no QR code was found.
+    The image is loaded as grayscale within the `max_pixels` budget (see src.qr.MAX_PIXELS).
+    """
+    from src.qr import decode_qr, load_gray
+    with metrics.timer("receipt_stage_seconds", stage="qr_load"):
+        gray = load_gray(file, max_pixels)
+    res = decode_qr(gray)
+    if not res["data"]:
+        return {}
+    return {"url": res["data"], "qr": {k: res[k] for k in ("strategy", "timings", "elapsed_ms")}}
 
-def parse_from_qr_image(file) -> dict[str, any]:
-    img = Image.open(file).convert("RGB")
-    data = _decode_qr_pyzbar(img) or _decode_qr_opencv(img)
-    return {"url": data} if data else {}
+def scan_receipts(file, max_pixels: int | None = None):
+    """
+    Yield (page_no, url) for every QR code on every page of an upload (photo, multi-page
+    TIFF or PDF), skipping URLs already seen on earlier pages. Pages are decoded one by one.
+    """
+    from src.qr import decode_all, iter_pages
+    seen: set[str] = set()
+    for page_no, page in enumerate(iter_pages(file, max_pixels), start=1):
+        for url in decode_all(page):
+            key = normalize_receipt_url(url)
+            if key not in seen:
+                seen.add(key)
+                yield page_no, url
 
 def _try_params(url: str) -> dict[str, any]:
     """
@@ -64,7 +76,7 @@ def _try_params(url: str) -> dict[str, any]:
             out["amount"] = float(amt)
         if ts: out["ts"] = _from_string_to_iso(ts)
     except Exception:
-        pass
+        metrics.inc("receipt_parse_errors_total", field="url_params")
     return out
 
 _SERB_STORE_PATTERNS = [
@@ -89,35 +101,136 @@ def _num_to_cents(s: str) -> int:
     s = _NUM.sub('', s).replace('.', '').replace(',', '.')
     return float(s)
 
-def _find_text(soup: BeautifulSoup, selectors: list[str]) -> str | None:
+def _find_text(soup: "BeautifulSoup", selectors: list[str], field: str) -> str | None:
     for sel in selectors:
         el = soup.select_one(sel)
         if el:
             txt = el.get_text(strip=True)
             if txt:
+                metrics.inc("extract_match_total", extractor="soup", field=field, source=sel)
                 return txt
     return None
 
-def _find_by_label_text(soup: BeautifulSoup, labels: list[str]) -> str | None:
-    rx = re.compile('|'.join(labels), re.I)
+_DIGIT = re.compile(r'\d')
+_LABEL_VALUE = re.compile(r'([0-9\.\,\s\u00A0]+)(RSD|дин|RSD)?')
+
+@lru_cache(maxsize=None)
+def _label_rx(labels: tuple[str, ...]) -> re.Pattern:
+    return re.compile('|'.join(labels), re.I)
+
+def _find_by_label_text(soup: "BeautifulSoup", labels: list[str], field: str) -> str | None:
+    val = _label_value(soup, labels)
+    if val:
+        metrics.inc("extract_match_total", extractor="soup", field=field, source="label")
+    return val
+
+def _label_value(soup: "BeautifulSoup", labels: list[str]) -> str | None:
+    rx = _label_rx(tuple(labels))
     for tag in soup.find_all(text=rx):
+        if "\n" in tag.strip():
+            # label inside a block of text (the <pre> journal): the value is on its line,
+            # or in the next element when the label ends the block
+            line, _, rest = tag[rx.search(tag).end():].partition("\n")
+            m = _DATE_RX.search(line) or _LABEL_VALUE.search(line)
+            if m and _DIGIT.search(m.group(1)):
+                return m.group(1).strip()
+            if rest.strip():
+                continue
         parent = tag.parent
         t = parent.get_text(" ", strip=True)
-        m = re.search(r'([0-9\.\,\s\u00A0]+)(RSD|дин|RSD)?', t)
+        m = _LABEL_VALUE.search(t)
         if m:
             val = m.group(1).strip()
-            if re.search(r'\d', val):
+            if _DIGIT.search(val):
                 return val
-        sib = parent.find_next(string=re.compile(r'\d'))
+        sib = parent.find_next(string=_DIGIT)
         if sib:
             val = sib.strip()
-            if re.search(r'\d', val):
+            if _DIGIT.search(val):
                 return val
     return None
 
-def _extract_html(html: str) -> dict:
+_STORE_IDS = ["shopFullNameLabel", "sellerNameLabel"]
+_AMOUNT_IDS = ["totalAmountLabel", "amountToPayLabel", "amountToPayWithVATLabel", "totalLabel"]
+_DATE_IDS = ["sdcDateTimeLabel", "issueDateTimeLabel"]
+
+_UNDECIDED = object()
+
+@lru_cache(maxsize=None)
+def _id_rx(el_id: str) -> re.Pattern:
+    # opening tag carrying the id as an attribute of its own (not data-id=, not inside
+    # another attribute's value), then (optionally) plain text up to its own closing tag
+    return re.compile(
+        r'<([a-zA-Z][\w:-]*)(?:\s+[^\s"\'<>/=]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'<>]+))?)*?'
+        r'\s+id\s*=\s*(["\'])' + re.escape(el_id) + r'\2[^>]*>(?:([^<]*)</\1\s*>)?')
+
+# markup BeautifulSoup does not parse as elements: comments and script/style bodies
+_OPAQUE = re.compile(r'<!--.*?(?:-->|\Z)|<(script|style)\b.*?(?:</\1\s*>|\Z)', re.I | re.S)
+
+def _in_opaque(html: str, pos: int) -> bool:
+    for m in _OPAQUE.finditer(html):
+        if m.start() >= pos:
+            return False
+        if m.end() > pos:
+            return True
+    return False
+
+def _scan_ids(html: str, ids: list[str], field: str):
+    """
+    Regex counterpart of `_find_text` for plain `#id` selectors. Returns the text of the
+    first non-empty element, or _UNDECIDED when no id carries text or the markup is not
+    simple enough to be sure (nested tags, odd quoting, a match inside a comment or a
+    script) - BeautifulSoup decides then.
+    """
+    for el_id in ids:
+        if el_id not in html:
+            continue
+        m = _id_rx(el_id).search(html)
+        if not m or m.group(3) is None or _in_opaque(html, m.start()):
+            metrics.inc("extract_undecided_total", field=field)
+            return _UNDECIDED
+        txt = unescape(m.group(3)).strip()
+        if txt:
+            metrics.inc("extract_match_total", extractor="regex", field=field, source="#" + el_id)
+            return txt
+    return _UNDECIDED
+
+def _extract_regex(html: str) -> dict:
+    """
+    Single-pass fast path for the portal's labelled-id page layout. Only returns
+    fields it is certain BeautifulSoup would produce identically.
+    """
     out: dict = {}
+    store = _scan_ids(html, _STORE_IDS, "store")
+    if store is not _UNDECIDED:
+        out["store"] = store
+    amount_txt = _scan_ids(html, _AMOUNT_IDS, "amount")
+    if amount_txt is not _UNDECIDED:
+        try:
+            out["amount"] = _num_to_cents(amount_txt)
+        except Exception:
+            metrics.inc("receipt_parse_errors_total", field="amount")
+    dt = _scan_ids(html, _DATE_IDS, "ts")
+    if dt is not _UNDECIDED:
+        out["ts"] = _from_string_to_iso(dt)
+    return out
+
+_PRE_STORE = re.compile(r'^[A-Z0-9][A-Z0-9 _\.\-]{2,}$', re.M)
+_PRE_TOTAL = re.compile(r"(Укупан износ|За уплату).*?([0-9\.\,\s\u00A0]+)", re.I | re.S)
+_DATE_RX = re.compile(r'(\d{2}\.\d{2}\.\d{4}\.\s+\d{2}:\d{2}:\d{2})')
+
+def _extract_soup(html: str) -> dict:
+    out: dict = {}
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, "html.parser")
+    pre_text = None
+
+    def pre():
+        nonlocal pre_text
+        if pre_text is None:
+            el = soup.find("pre")
+            pre_text = el.get_text() if el else ""
+        return pre_text
 
     # ----- STORE -----
     store = _find_text(soup, [
@@ -125,13 +238,12 @@ def _extract_html(html: str) -> dict:
         "#sellerNameLabel",
         "span.badge",
         "[data-testid='shopFullName']",
-    ])
-    if not store:
-        pre = soup.find("pre")
-        if pre:
-            m = re.search(r'^[A-Z0-9][A-Z0-9 _\.\-]{2,}$', pre.get_text(), flags=re.M)
-            if m:
-                store = m.group(0).strip()
+    ], "store")
+    if not store and pre():
+        m = _PRE_STORE.search(pre())
+        if m:
+            store = m.group(0).strip()
+            metrics.inc("extract_match_total", extractor="soup", field="store", source="pre")
     if store:
         out["store"] = store
 
@@ -141,65 +253,187 @@ def _extract_html(html: str) -> dict:
         "#amountToPayLabel",
         "#amountToPayWithVATLabel",
         "#totalLabel",
-    ])
+    ], "amount")
     if not amount_txt:
         amount_txt = _find_by_label_text(soup, [
             r"Укупан\s+износ", r"За\s+уплату", r"Ukupan\s+iznos", r"Total\s+amount",
             r"Iznos\s+za\s+uplatu"
-        ])
-    if not amount_txt:
-        pre = soup.find("pre")
-        if pre:
-            m = re.search(r"(Укупан износ|За уплату).*?([0-9\.\,\s\u00A0]+)", pre.get_text(), flags=re.I|re.S)
-            if m:
-                amount_txt = m.group(2).strip()
+        ], "amount")
+    if not amount_txt and pre():
+        m = _PRE_TOTAL.search(pre())
+        if m:
+            amount_txt = m.group(2).strip()
+            metrics.inc("extract_match_total", extractor="soup", field="amount", source="pre")
     if amount_txt:
         try:
             out["amount"] = _num_to_cents(amount_txt)
         except Exception:
-            pass
+            metrics.inc("receipt_parse_errors_total", field="amount")
 
     # ----- DATE/TIME -----
     dt = _find_text(soup, [
         "#sdcDateTimeLabel",
         "#issueDateTimeLabel",
         "[data-testid='issueDateTime']",
-    ])
+    ], "ts")
     if not dt:
         # label-based
-        cand = _find_by_label_text(soup, [r"ПФР време", r"Време", r"Datum", r"Date"])
-        if cand and re.search(r'\d{2}\.\d{2}\.\d{4}\.\s+\d{2}:\d{2}:\d{2}', cand):
+        cand = _label_value(soup, [r"ПФР време", r"Време", r"Datum", r"Date"])
+        if cand and _DATE_RX.search(cand):
             dt = cand
-    if not dt:
-        pre = soup.find("pre")
-        if pre:
-            m = re.search(r'(\d{2}\.\d{2}\.\d{4}\.\s+\d{2}:\d{2}:\d{2})', pre.get_text())
-            if m:
-                dt = m.group(1)
+            metrics.inc("extract_match_total", extractor="soup", field="ts", source="label")
+    if not dt and pre():
+        m = _DATE_RX.search(pre())
+        if m:
+            dt = m.group(1)
+            metrics.inc("extract_match_total", extractor="soup", field="ts", source="pre")
     if dt:
         out["ts"] = _from_string_to_iso(dt)
 
     return out
 
-def parse_from_url(url: str) -> dict:
+_FIELDS = ("store", "amount", "ts")
+
+# Extraction backends, tried in order; each returns only the fields it is sure about.
+# BeautifulSoup (`_extract_soup`) always runs last for whatever is still missing.
+EXTRACTORS: list[tuple[str, Callable[[str], dict]]] = [("regex", _extract_regex)]
+
+def register_extractor(name: str, fn: Callable[[str], dict]):
+    EXTRACTORS.insert(0, (name, fn))
+
+def _extract_fields(html: str) -> dict:
+    out: dict = {}
+    for name, fn in EXTRACTORS:
+        out = {**fn(html), **out}
+        if all(k in out for k in _FIELDS):
+            metrics.inc("extract_path_total", extractor=name)
+            return out
+    metrics.inc("extract_path_total", extractor="soup")
+    return {**_extract_soup(html), **out}
+
+_PRE_BLOCK = re.compile(r'<pre\b[^>]*>(.*?)</pre\s*>', re.I | re.S)
+
+def _journal_text(html: str) -> str:
+    """Text of the first <pre> block (the fiscal journal); BeautifulSoup only for nested markup."""
+    m = _PRE_BLOCK.search(html)
+    if not m:
+        return ""
+    if "<" not in m.group(1):
+        return unescape(m.group(1))
+    from bs4 import BeautifulSoup
+    pre = BeautifulSoup(m.group(0), "html.parser").find("pre")
+    return pre.get_text() if pre else ""
+
+_ITEMS_HEADER = re.compile(r'^\s*(Назив|Naziv)\s+(Цена|Cena)\s+(Кол|Kol)', re.I)
+_ITEMS_END = re.compile(r'^\s*(-{5,}|=+\s*$|Укупан\s+износ|Ukupan\s+iznos)', re.I)
+_ITEM_NUMBERS = re.compile(
+    r'^(?P<name>.*?)\s*(?P<price>-?[\d.]+,\d{2})\s+(?P<qty>-?[\d.]+(?:,\d+)?)\s+(?P<total>-?[\d.]+,\d{2})\s*$')
+_ITEM_VAT = re.compile(r'\s*\(([^()]{1,3})\)\s*$')
+
+def parse_journal_items(text: str) -> list[dict]:
+    """
+    Line items from the receipt journal, in one pass over its lines. An item is a name
+    (possibly wrapped over several lines, VAT label in trailing parentheses) followed by
+    "unit price  quantity  total"; the list runs from the "Назив Цена Кол. Укупно" header
+    to the next separator or the total line.
+    """
+    items: list[dict] = []
+    in_items = False
+    name_parts: list[str] = []
+    for line in text.splitlines():
+        if not in_items:
+            in_items = bool(_ITEMS_HEADER.match(line))
+            continue
+        if _ITEMS_END.match(line):
+            break
+        m = _ITEM_NUMBERS.match(line)
+        if not m:
+            if line.strip():
+                name_parts.append(line.strip())
+            continue
+        if m.group("name").strip():
+            name_parts.append(m.group("name").strip())
+        name = " ".join(name_parts)
+        name_parts = []
+        vat = _ITEM_VAT.search(name)
+        if vat:
+            name = name[:vat.start()]
+        items.append({
+            "name": name.strip(),
+            "qty": _num_to_cents(m.group("qty")),
+            "unit_price": _num_to_cents(m.group("price")),
+            "total": _num_to_cents(m.group("total")),
+            "vat": vat.group(1) if vat else None,
+        })
+    return items
+
+def _extract_html(html: str) -> dict:
+    with metrics.timer("receipt_stage_seconds", stage="extract"):
+        return _extract_all(html)
+
+def _extract_all(html: str) -> dict:
+    out = _extract_fields(html)
+    items = parse_journal_items(_journal_text(html))
+    if items:
+        out["items"] = items
+    return out
+
+def _fetch_and_extract(url: str, db_path=None) -> dict:
+    if db_path is None:
+        from src.fetch import fetch_html
+        html = fetch_html(url)
+        return _extract_html(html) if html else {}
+
+    from src.db import cache_get_receipt, cache_put_receipt
+    key = normalize_receipt_url(url)
+    cached = cache_get_receipt(db_path, key)
+    data = {}
+    if cached and _cacheable(cached["data"]):
+        if cached["parser_version"] == PARSER_VERSION:
+            metrics.inc("receipt_cache_total", result="hit")
+            return cached["data"]
+        metrics.inc("receipt_cache_total", result="stale")
+        html = cached["html"]
+        data = _extract_html(html)
+    if not _cacheable(data):
+        # a miss, or an entry older versions stored for an error/maintenance page
+        metrics.inc("receipt_cache_total", result="miss")
+        from src.fetch import fetch_html
+        html = fetch_html(url)
+        if not html:
+            return {}
+        data = _extract_html(html)
+    if _cacheable(data):
+        cache_put_receipt(db_path, key, html, data, PARSER_VERSION)
+    else:
+        metrics.inc("receipt_cache_total", result="not_stored")
+    return data
+
+def _cacheable(data: dict) -> bool:
+    """Only pages that gave store and amount are cached; anything else is fetched again."""
+    return bool(data.get("store") and data.get("amount"))
+
+def parse_from_url(url: str, db_path=None, strict: bool = False) -> dict:
+    """
+    With `db_path` given, receipt pages are served from / stored into the on-disk
+    cache in that database (fiscal receipts are immutable; pages that gave no store
+    and amount are not cached). With `strict`, a failed
+    fetch or a page without store and amount (portal error or maintenance page) raises
+    instead of returning whatever the URL parameters gave, so callers can retry.
+    """
     if not url:
         return {}
     result = _try_params(url)
 
     if not (result.get("store") and result.get("amount") and result.get("ts")):
         try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X) AppleWebKit/537.36 "
-                              "(KHTML, like Gecko) Chrome/127.0 Safari/537.36",
-                "Accept-Language": "sr-RS,sr;q=0.9,en;q=0.8"
-            }
-            r = requests.get(url, timeout=15, headers=headers)
-            r.encoding = "utf-8"
-            if r.ok and r.text:
-                html_data = _extract_html(r.text)
-                result = {**html_data, **result}
-        except Exception:
-            pass
+            html_data = _fetch_and_extract(url, db_path)
+            result = {**html_data, **result}
+        except Exception as e:
+            metrics.inc("receipt_fetch_failures_total", error=type(e).__name__)
+            if strict:
+                raise
+        if strict and not (result.get("store") and result.get("amount")):
+            raise ValueError("receipt page could not be read (store/amount missing)")
 
     return result
-
@@ -0,0 +1,202 @@
+# src/service.py
+"""
+Local receipt resolution service.
+
+    python -m src.service --port 8765
+
+    POST /jobs          {"url": "..."}       -> 202 {"id": ..., "status": "queued"}
+    POST /jobs/image    raw image/PDF bytes  -> 202 {"id": ..., "status": "queued"}
+    GET  /jobs/<id>                          -> job status and result
+    GET  /health                             -> queue depth
+
+A job is `done` when at least one of its receipts was saved (or already stored; the
+result lists every receipt's status) and `failed`, with each receipt's error, otherwise.
+Jobs are persisted in the `jobs` table before they are acknowledged, so queued and
+interrupted jobs are picked up again after a restart. The in-memory queue is bounded:
+when it is full, submissions get 503 with Retry-After instead of piling up.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from pathlib import Path
+
+from src import metrics
+from src.batch import ingest
+from src.db import add_db_args, add_job, get_job, init_db, pending_jobs, resolve_db, set_job_status
+from src.receipt import scan_receipts
+
+MAX_BODY = 25 * 1024 * 1024
+
+log = logging.getLogger(__name__)
+
+
+def _resolve(db_path: Path, kind: str, payload: bytes, fetch_workers: int) -> dict:
+    """
+    Blocking part of a job: QR scan (images), portal fetch + parse, insert. Raises (the
+    job fails) when no receipt was saved or found already saved.
+    """
+    if kind == "image":
+        urls = [u for _, u in scan_receipts(io.BytesIO(payload))]
+        if not urls:
+            raise ValueError("QR not found")
+    else:
+        urls = [payload.decode("utf-8")]
+    report = ingest(db_path, urls, fetch_workers=fetch_workers, use_processes=False)
+    if not any(r["status"] in ("ok", "duplicate") for r in report):
+        raise RuntimeError("; ".join(f"{r['url'] or r['source']}: {r['error']}" for r in report))
+    return {"receipts": report}
+
+
+class ReceiptService:
+    def __init__(self, db_path: Path, workers: int = 4, queue_size: int = 100, fetch_workers: int = 4):
+        self.db_path = db_path
+        self.workers = workers
+        self.fetch_workers = fetch_workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="receipt-job")
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        await asyncio.to_thread(init_db, self.db_path)
+        # read before the first request is accepted: a job submitted meanwhile would be
+        # both in this list and in the queue, and run twice
+        pending = await asyncio.to_thread(pending_jobs, self.db_path)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._requeue(pending)))
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _requeue(self, pending: list):
+        # waits for free slots instead of failing when more jobs are pending than fit the queue
+        for job in pending:
+            await self.queue.put(job)
+
+    async def submit(self, kind: str, payload: bytes) -> str | None:
+        """Persist and enqueue a job; None when the queue is full (caller answers 503)."""
+        if self.queue.full():
+            return None
+        # SQLite calls run off the event loop: a locked database (busy_timeout) must not
+        # stall every other connection
+        job_id = await asyncio.to_thread(add_job, self.db_path, kind, payload)
+        try:
+            self.queue.put_nowait((job_id, kind, payload))
+        except asyncio.QueueFull:   # filled up while the job was being stored
+            await asyncio.to_thread(set_job_status, self.db_path, job_id, "failed", error="queue full")
+            return None
+        return job_id
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id, kind, payload = await self.queue.get()
+            try:
+                await asyncio.to_thread(set_job_status, self.db_path, job_id, "running")
+                try:
+                    result = await loop.run_in_executor(
+                        self.executor, _resolve, self.db_path, kind, payload, self.fetch_workers)
+                except Exception as e:
+                    await asyncio.to_thread(set_job_status, self.db_path, job_id, "failed", error=str(e))
+                else:
+                    await asyncio.to_thread(set_job_status, self.db_path, job_id, "done", result=result)
+            except Exception as e:
+                # status write failed (database locked past busy_timeout); the job stays
+                # queued/running in the table and is picked up again on the next start
+                log.error("job %s: could not record status: %s", job_id, e)
+            finally:
+                self.queue.task_done()
+
+    async def _route(self, method: str, path: str, body: bytes) -> tuple[int, dict, dict]:
+        if method == "GET" and path == "/health":
+            return 200, {"queued": self.queue.qsize(), "capacity": self.queue.maxsize, "workers": self.workers}, {}
+        if method == "GET" and path.startswith("/jobs/"):
+            job = await asyncio.to_thread(get_job, self.db_path, path[len("/jobs/"):])
+            return (200, job, {}) if job else (404, {"error": "unknown job"}, {})
+        if method == "POST" and path in ("/jobs", "/jobs/image"):
+            if path == "/jobs":
+                req = json.loads(body or b"{}")
+                url = req.get("url") if isinstance(req, dict) else None
+                if not isinstance(url, str) or not url.strip():
+                    return 400, {"error": "url is required"}, {}
+                job_id = await self.submit("url", url.strip().encode("utf-8"))
+            else:
+                if not body:
+                    return 400, {"error": "empty body"}, {}
+                job_id = await self.submit("image", body)
+            if job_id is None:
+                return 503, {"error": "queue full"}, {"Retry-After": "5"}
+            return 202, {"id": job_id, "status": "queued"}, {"Location": f"/jobs/{job_id}"}
+        return 404, {"error": "not found"}, {}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        extra: dict = {}
+        try:
+            try:
+                method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = line.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY:
+                    status, payload = 413, {"error": "body too large"}
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload, extra = await self._route(method.upper(), target.split("?", 1)[0], body)
+            except (ValueError, asyncio.IncompleteReadError):
+                status, payload = 400, {"error": "bad request"}
+            except sqlite3.OperationalError as e:
+                # database locked past busy_timeout: worth retrying shortly
+                log.warning("request failed: %s", e)
+                status, payload, extra = 503, {"error": "database busy"}, {"Retry-After": "5"}
+            except Exception:
+                log.exception("request failed")
+                status, payload, extra = 500, {"error": "internal error"}, {}
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                    "Content-Type: application/json; charset=utf-8",
+                    f"Content-Length: {len(data)}",
+                    "Connection: close",
+                    *(f"{k}: {v}" for k, v in extra.items())]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(db_path: Path, host: str, port: int, workers: int, queue_size: int):
+    service = ReceiptService(db_path, workers=workers, queue_size=queue_size)
+    server = await service.start(host, port)
+    print(f"receipt service on http://{host}:{port} (db {db_path})")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Local receipt resolution service")
+    add_db_args(ap)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--queue-size", type=int, default=100)
+    ap.add_argument("--metrics-port", type=int, help="enable metrics and serve them at :PORT/metrics")
+    args = ap.parse_args(argv)
+    if args.metrics_port is not None:
+        metrics.enable()
+        metrics.serve(args.metrics_port)
+    try:
+        asyncio.run(serve(resolve_db(args.db, args.user), args.host, args.port, args.workers, args.queue_size))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
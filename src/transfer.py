@@ -0,0 +1,219 @@
+# src/transfer.py
+"""
+Streaming export/import of the `transactions` and `rules` tables as CSV or Parquet.
+Rows move in fixed-size chunks, so memory stays flat regardless of history size.
+Parquet needs pyarrow (optional dependency).
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from src.db import add_db_args, get_conn, init_db, insert_many_tx, resolve_db, transaction
+from src.identity import receipt_key
+
+CHUNK_SIZE = 50_000
+
+TABLE_COLUMNS = {
+    "transactions": ["id", "ts", "store", "amount", "currency", "category", "kind", "source",
+                     "raw_url", "meta_json", "category_manual", "receipt_key"],
+    "rules": ["id", "pattern", "category", "enabled", "priority"],
+}
+INT_COLUMNS = {"id", "category_manual", "enabled", "priority"}
+KINDS = {"expense", "income"}
+
+
+def _fmt(path: Path, fmt: str | None) -> str:
+    fmt = (fmt or path.suffix.lstrip(".")).lower()
+    if fmt not in ("csv", "parquet"):
+        raise ValueError(f"unsupported format: {fmt!r} (csv or parquet)")
+    return fmt
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError as e:
+        raise RuntimeError("Parquet export/import requires pyarrow: pip install pyarrow") from e
+
+
+def _chunks(db_path: Path, table: str, chunk_size: int):
+    cols = TABLE_COLUMNS[table]
+    cur = get_conn(db_path).cursor()
+    cur.execute(f"SELECT {', '.join(cols)} FROM {table} ORDER BY id")
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def export_table(db_path: Path, table: str, path: Path, fmt: str | None = None,
+                 chunk_size: int = CHUNK_SIZE) -> int:
+    """Write `table` to `path`; returns the number of rows exported."""
+    path = Path(path)
+    fmt = _fmt(path, fmt)
+    cols = TABLE_COLUMNS[table]
+    n = 0
+    if fmt == "csv":
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(cols)
+            for rows in _chunks(db_path, table, chunk_size):
+                w.writerows(rows)
+                n += len(rows)
+        return n
+
+    pa = _pyarrow()
+    schema = pa.schema([(c, pa.float64() if c == "amount" else pa.int64() if c in INT_COLUMNS else pa.string())
+                        for c in cols])
+    with pa.parquet.ParquetWriter(str(path), schema) as writer:
+        for rows in _chunks(db_path, table, chunk_size):
+            writer.write_table(pa.Table.from_pylist([dict(zip(cols, r)) for r in rows], schema=schema))
+            n += len(rows)
+    return n
+
+
+def _read_rows(path: Path, fmt: str, chunk_size: int):
+    if fmt == "csv":
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+        return
+    pa = _pyarrow()
+    for batch in pa.parquet.ParquetFile(str(path)).iter_batches(batch_size=chunk_size):
+        yield from batch.to_pylist()
+
+
+def _clean_tx(r: dict) -> dict:
+    """Validated transaction dict from an imported row; raises ValueError on bad data."""
+    store = str(r.get("store") or "").strip()
+    category = str(r.get("category") or "").strip()
+    if not store or not category:
+        raise ValueError("store and category are required")
+    ts = datetime.fromisoformat(str(r.get("ts") or "")).isoformat()
+    raw = r.get("amount")
+    amount = float(raw) if raw not in (None, "") else math.nan
+    if not math.isfinite(amount):   # "nan"/"inf" parse but would hit the NOT NULL constraint
+        raise ValueError(f"amount must be a finite number, got {raw!r}")
+    kind = str(r.get("kind") or "expense").strip()
+    if kind not in KINDS:
+        raise ValueError(f"unknown kind {kind!r}")
+    meta = r.get("meta_json")
+    raw_url = str(r.get("raw_url") or "").strip() or None
+    # keep the exported key, NULL included: rows stored without one (e.g. two identical
+    # manual entries) must not collapse on import. Files without the column dedup by URL.
+    key = str(r.get("receipt_key") or "").strip() or None
+    if "receipt_key" not in r:
+        key = receipt_key(raw_url)
+    return {
+        "ts": ts,
+        "store": store,
+        "amount": amount,
+        "currency": str(r.get("currency") or "RSD").strip(),
+        "category": category,
+        "kind": kind,
+        "source": str(r.get("source") or "import").strip(),
+        "raw_url": raw_url,
+        "meta_json": json.loads(meta) if meta else None,
+        "category_manual": str(r.get("category_manual") or "0").strip() not in ("", "0", "False", "false"),
+        "receipt_key": key,
+    }
+
+
+def import_transactions(db_path: Path, path: Path, fmt: str | None = None,
+                        chunk_size: int = CHUNK_SIZE) -> dict[str, any]:
+    """
+    Bulk-load transactions exported by `export_table`. Ids are reassigned; rows whose
+    receipt key (or, for files without that column, raw_url) is already stored are
+    skipped, invalid rows are counted and skipped.
+    Everything is inserted inside one transaction.
+    """
+    path = Path(path)
+    fmt = _fmt(path, fmt)
+    init_db(db_path)
+    started = time.perf_counter()
+    stats = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0, "errors": []}
+
+    with transaction(db_path):
+        batch: list[dict] = []
+
+        def flush():
+            inserted = insert_many_tx(db_path, batch)
+            stats["inserted"] += inserted
+            stats["duplicates"] += len(batch) - inserted
+            batch.clear()
+
+        for r in _read_rows(path, fmt, chunk_size):
+            stats["read"] += 1
+            try:
+                batch.append(_clean_tx(r))
+            except (TypeError, ValueError) as e:
+                stats["invalid"] += 1
+                if len(stats["errors"]) < 20:
+                    stats["errors"].append(f"row {stats['read']}: {e}")
+                continue
+            if len(batch) >= chunk_size:
+                flush()
+        if batch:
+            flush()
+
+    elapsed = time.perf_counter() - started
+    stats["elapsed"] = elapsed
+    stats["rows_per_sec"] = stats["read"] / elapsed if elapsed > 0 else 0.0
+    return stats
+
+
+def import_rules(db_path: Path, path: Path, fmt: str | None = None) -> int:
+    """Append rules; a rule with the same pattern and category as an existing one is skipped."""
+    path = Path(path)
+    fmt = _fmt(path, fmt)
+    init_db(db_path)
+    n = 0
+    with transaction(db_path) as conn:
+        existing = set(conn.execute("SELECT pattern, category FROM rules").fetchall())
+        for r in _read_rows(path, fmt, CHUNK_SIZE):
+            key = (str(r.get("pattern") or ""), str(r.get("category") or ""))
+            if not key[0] or not key[1] or key in existing:
+                continue
+            conn.execute("INSERT INTO rules(pattern, category, enabled, priority) VALUES (?,?,?,?)",
+                         (*key, int(r.get("enabled") or 0), int(r.get("priority") or 100)))
+            existing.add(key)
+            n += 1
+    return n
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Export/import transactions and rules (CSV or Parquet)")
+    ap.add_argument("command", choices=["export", "import"])
+    ap.add_argument("table", choices=list(TABLE_COLUMNS))
+    ap.add_argument("path", type=Path)
+    add_db_args(ap)
+    ap.add_argument("--format", choices=["csv", "parquet"], help="default: from the file extension")
+    ap.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = ap.parse_args(argv)
+    args.db = resolve_db(args.db, args.user)
+
+    started = time.perf_counter()
+    if args.command == "export":
+        init_db(args.db)
+        n = export_table(args.db, args.table, args.path, args.format, args.chunk_size)
+        print(f"exported {n} rows in {time.perf_counter() - started:.2f}s")
+    elif args.table == "rules":
+        print(f"imported {import_rules(args.db, args.path, args.format)} rules")
+    else:
+        st = import_transactions(args.db, args.path, args.format, args.chunk_size)
+        for e in st["errors"]:
+            print(e, file=sys.stderr)
+        print(f"read {st['read']}, inserted {st['inserted']}, duplicates {st['duplicates']}, "
+              f"invalid {st['invalid']} ({st['rows_per_sec']:.0f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())